@@ -1,76 +1,205 @@
 import os
-import json
-import uuid
+import re
+import math
+import time
+import hashlib
+import asyncio
 import aiohttp
+import orjson
 import logging
 import random
-from typing import List, Dict, Optional
+import sqlite3
+import string
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import List, Dict, Optional, Tuple
 from models import GeneratedQuestion, VerificationResult, SourceChunk, QuestionType, Difficulty
 
 logger = logging.getLogger(__name__)
 
+_QTYPE_VALUES = frozenset(qt.value for qt in QuestionType)
+_QTYPE_BY_VALUE = {qt.value: qt for qt in QuestionType}
+
 DEEPSEEK_API_URL = "https://api.deepseek.com/v1/chat/completions"
+RESPONSE_CACHE_SIZE = 512
+RESPONSE_CACHE_TTL = 3600
+MAX_OUTPUT_TOKENS = 8192
+CHUNK_TEXT_LIMIT = 800
+MAX_CONTEXT_CHARS = 16000
+CONTEXT_CACHE_SIZE = 64
+CHUNK_FORMAT_CACHE_SIZE = 4096
+# 5-10 short concepts fit well under this; the default 2000 only invites rambling
+CONCEPTS_MAX_TOKENS = 1200
+MIN_LLM_CONTEXT_CHARS = 400
+DEEPSEEK_MAX_RETRIES = int(os.environ.get("DEEPSEEK_MAX_RETRIES", "3"))
+# Upper bound on a server-requested Retry-After, so a round timer isn't outlived
+MAX_RETRY_AFTER = 10.0
+DISK_CACHE_PATH = os.path.join(os.path.dirname(__file__), "data", "deepseek_cache.db")
+# The disk cache is pruned on open and every DISK_CACHE_PRUNE_EVERY writes:
+# entries older than DISK_CACHE_MAX_AGE go, then the oldest beyond the row cap
+DISK_CACHE_MAX_AGE = 7 * 24 * 3600
+DISK_CACHE_MAX_ROWS = 20000
+DISK_CACHE_PRUNE_EVERY = 500
+
+SYSTEM_PROMPT = "You are a helpful assistant that outputs only valid JSON."
 
+# Prompts are split into static instructions (sent as the system message) and a
+# per-call input template, so the provider's prefix cache covers the instructions
 GENERATE_PROBLEM_PROMPT = """You are a math/CS exam writer. ONLY use the provided context. Create ONE concise, student-friendly problem solvable with the context.
 
 Output JSON ONLY with these keys:
-{{
+{
   "question_id": "<uuid>",
   "question_text": "...",
   "question_type": "mcq|short|calc|code",
   "options": ["A ...", "B ...", "C ...", "D ..."] OR null,
   "correct_answer": "...",
   "solution_steps": "...",
-  "source_chunks": [{{"file_name":"", "page":1, "chunk_id": "..."}}]
-}}
+  "source_chunks": [{"file_name":"", "page":1, "chunk_id": "..."}]
+}
 
 Requirements:
-- question_type must be one of: {question_types}
-- difficulty level: {difficulty}
+- question_type must be one of the allowed types given after the context
+- match the difficulty level given after the context
 - For MCQ: exactly 4 options (A–D)
 - For short/calc/code: options must be null
 - question_text ≤ 200 characters; do not paste long context quotes
 - solution_steps must be clear and step-by-step
 - source_chunks must reference real chunks from Context
+"""
 
-Context:
+GENERATE_PROBLEM_INPUT = """Context:
 {context}
+
+Allowed question types: {question_types}
+Difficulty level: {difficulty}
 """
 
-VERIFY_ANSWER_PROMPT = """You are an objective grader. Use ONLY the context below and the official solution. Evaluate the student's submitted answer.
+GENERATE_PROBLEMS_BATCH_PROMPT = """You are a math/CS exam writer. ONLY use the provided context. Create the requested number of DISTINCT, concise, student-friendly problems solvable with the context.
+
+Return JSON ONLY:
+{
+  "questions": [
+    {
+      "question_id": "<uuid>",
+      "question_text": "...",
+      "question_type": "mcq|short|calc|code",
+      "options": ["A ...", "B ...", "C ...", "D ..."] OR null,
+      "correct_answer": "...",
+      "solution_steps": "...",
+      "source_chunks": [{"file_name":"", "page":1, "chunk_id": "..."}]
+    },
+    ...
+  ]
+}
+
+Requirements:
+- exactly the number of problems given after the context, none repeating another
+- question_type must be one of the allowed types given after the context
+- match the difficulty level given after the context
+- For MCQ: exactly 4 options (A–D)
+- For short/calc/code: options must be null
+- question_text ≤ 200 characters; do not paste long context quotes
+- solution_steps must be clear and step-by-step
+- source_chunks must reference real chunks from Context
+"""
+
+GENERATE_PROBLEMS_BATCH_INPUT = GENERATE_PROBLEM_INPUT + """Number of problems: {count}
+"""
+
+VERIFY_ANSWER_PROMPT = """You are an objective grader. Use ONLY the context and the official solution you are given. Evaluate the student's submitted answer.
 
 Return JSON ONLY (no markdown, no code blocks):
-{{
+{
   "correct": true|false,
   "confidence": 0.0-1.0,
   "explanation": "...",
-  "citation": [{{"file_name":"", "page":1, "chunk_id":"..."}}]
-}}
+  "citation": [{"file_name":"", "page":1, "chunk_id":"..."}]
+}
+
+Grading rules:
+- For MCQ: exact letter match required (A, B, C, or D)
+- For short answers: semantic equivalence is acceptable
+- For calc: numerical answer must match (allow small rounding differences)
+- For code: logic must be correct, syntax variations acceptable
+"""
 
-Context:
+VERIFY_ANSWER_INPUT = """Context:
 {context}
 
 Official Solution: {solution}
 Correct Answer: {correct_answer}
 
 Student Answer: {student_answer}
-
-Grading rules:
-- For MCQ: exact letter match required (A, B, C, or D)
-- For short answers: semantic equivalence is acceptable
-- For calc: numerical answer must match (allow small rounding differences)
-- For code: logic must be correct, syntax variations acceptable
 """
 
+_CITATION_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "file_name": {"type": "string"},
+            "page": {"type": "integer"},
+            "chunk_id": {"type": "string"}
+        },
+        "required": ["file_name", "page", "chunk_id"]
+    }
+}
+
+# Function-calling tools make DeepSeek emit arguments matching these schemas
+EMIT_QUESTION_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "emit_question",
+        "description": "Return the generated problem.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "question_id": {"type": "string"},
+                "question_text": {"type": "string"},
+                "question_type": {"type": "string", "enum": [qt.value for qt in QuestionType]},
+                "options": {"type": ["array", "null"], "items": {"type": "string"}},
+                "correct_answer": {"type": "string"},
+                "solution_steps": {"type": "string"},
+                "source_chunks": _CITATION_SCHEMA
+            },
+            "required": [
+                "question_text", "question_type", "options",
+                "correct_answer", "solution_steps", "source_chunks"
+            ]
+        }
+    }
+}
+
+EMIT_VERIFICATION_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "emit_verification",
+        "description": "Return the grading result for the student's answer.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "correct": {"type": "boolean"},
+                "confidence": {"type": "number"},
+                "explanation": {"type": "string"},
+                "citation": _CITATION_SCHEMA
+            },
+            "required": ["correct", "confidence", "explanation", "citation"]
+        }
+    }
+}
+
 ANSWER_QA_PROMPT = """You are a helpful tutor. Use ONLY the provided context chunks to answer the user's question concisely.
 
 Return JSON ONLY:
-{{
+{
   "answer": "...",
-  "citation": [{{"file_name":"", "page":1, "chunk_id":"..."}}]
-}}
+  "citation": [{"file_name":"", "page":1, "chunk_id":"..."}]
+}
+"""
 
-Context:
+ANSWER_QA_INPUT = """Context:
 {context}
 
 User Question: {question}
@@ -79,51 +208,118 @@ User Question: {question}
 EXTRACT_CONCEPTS_PROMPT = """You are a course curator. Read the full context and extract the MAIN CONCEPTS.
 
 Return JSON ONLY:
-{{
+{
   "concepts": [
-    {{ "name": "...", "summary": "..." }},
+    { "name": "...", "summary": "..." },
     ...
   ]
-}}
+}
 
 Rules:
 - 5–10 concise concepts
 - Names should be human-readable titles (no formulas or raw statements)
 - Summaries ≤ 40 words, clear and student-friendly
 - Use ONLY what appears in the context
+"""
 
-Context:
+EXTRACT_CONCEPTS_INPUT = """Context:
 {context}
 """
 
+def _compile_template(template: str) -> Tuple[Tuple[str, Optional[str]], ...]:
+    # Parse the format string once into (literal, field_name) segments
+    segments = []
+    for literal, field_name, _, _ in string.Formatter().parse(template):
+        if literal:
+            segments.append((literal, None))
+        if field_name is not None:
+            segments.append(("", field_name))
+    return tuple(segments)
+
+def _render(segments: Tuple[Tuple[str, Optional[str]], ...], **kwargs) -> str:
+    return "".join(seg if key is None else str(kwargs[key]) for seg, key in segments)
+
+_GEN_SEGMENTS = _compile_template(GENERATE_PROBLEM_INPUT)
+_GEN_BATCH_SEGMENTS = _compile_template(GENERATE_PROBLEMS_BATCH_INPUT)
+_VERIFY_SEGMENTS = _compile_template(VERIFY_ANSWER_INPUT)
+_ANSWER_QA_SEGMENTS = _compile_template(ANSWER_QA_INPUT)
+_EXTRACT_CONCEPTS_SEGMENTS = _compile_template(EXTRACT_CONCEPTS_INPUT)
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_TRAILING_PUNCT_RE = re.compile(r"[\s.!?;:,]+$")
+_NON_ALNUM_RE = re.compile(r"[^A-Za-z0-9\s\-]")
+_PAGE_MARK_RE = re.compile(r"\bP\d+\b")
+_TITLE_RE = re.compile(r"([A-Z][A-Za-z]+(\s+[A-Z][A-Za-z]+)+)")
+_CONCEPT_KEYWORDS = ("definition", "rule", "theorem", "axiom", "example", "property", "concept")
+
+def _normalize_free_text(text: str, case_sensitive: bool = False) -> str:
+    # Collapses spacing, case and trailing punctuation so trivially different
+    # submissions of the same answer or question share a cache entry
+    text = _WHITESPACE_RE.sub(" ", (text or "").strip())
+    if case_sensitive:
+        return text
+    return _TRAILING_PUNCT_RE.sub("", text.casefold())
+
+def _qid() -> str:
+    # Opaque random id; cheaper than formatting a uuid4
+    return os.urandom(16).hex()
+
+def _mcq_letter(answer: str) -> str:
+    # Only the option letter matters, so upper-case just that one character
+    return answer.strip()[:1].upper()
+
+def _parse_number(answer: str) -> Optional[float]:
+    try:
+        value = float(answer.strip())
+    except ValueError:
+        return None
+    return value if math.isfinite(value) else None
+
+def _is_complete_json(response: str) -> bool:
+    # A reply cut off by max_tokens or a timeout can't end with a closing
+    # bracket, so it can be rejected without running the parser over it
+    return response.rstrip().endswith(("}", "]"))
+
+@lru_cache(maxsize=16)
+def _system_content(instructions: Optional[str]) -> str:
+    # Only a handful of fixed instruction blocks exist, so each system message
+    # is assembled once
+    return f"{SYSTEM_PROMPT}\n\n{instructions}" if instructions else SYSTEM_PROMPT
+
+@lru_cache(maxsize=64)
+def _types_str(question_types: Tuple[QuestionType, ...]) -> str:
+    return ", ".join(qt.value for qt in question_types)
+
+@lru_cache(maxsize=256)
 def _extract_concept_name(text: str) -> str:
     lines = [l.strip() for l in (text or "").splitlines() if l.strip()]
-    import re
     def clean_candidate(s: str) -> str:
         s = s.strip()
         if ":" in s:
             s = s.split(":", 1)[0].strip()
-        s = re.sub(r"[^A-Za-z0-9\s\-]", "", s)
-        s = re.sub(r"\s+", " ", s)
+        s = _NON_ALNUM_RE.sub("", s)
+        s = _WHITESPACE_RE.sub(" ", s)
         return s[:80]
-    keywords = ["Definition", "Rule", "Theorem", "Axiom", "Example", "Property", "Concept"]
     for l in lines[:8]:
-        for k in keywords:
-            if k.lower() in l.lower():
-                c = clean_candidate(l)
-                if len(c.split()) >= 2:
-                    return c
+        l_lower = l.lower()
+        if any(k in l_lower for k in _CONCEPT_KEYWORDS):
+            c = clean_candidate(l)
+            if len(c.split()) >= 2:
+                return c
         if sum(1 for w in l.split() if w[:1].isupper()) >= 2 and len(l.split()) <= 12:
             c = clean_candidate(l)
             if len(c.split()) >= 2:
                 return c
-    m = re.search(r"([A-Z][A-Za-z]+(\s+[A-Z][A-Za-z]+)+)", text or "")
+    m = _TITLE_RE.search(text or "")
     if m:
         return clean_candidate(m.group(1))
     words = (text or "").split()
     fallback = " ".join(words[:6]) if words else "main concept"
     return clean_candidate(fallback) or "main concept"
 
+# Fallback snippets come from the same few chunks round after round, so the
+# keyword scan over their text is memoized
+@lru_cache(maxsize=256)
 def _curated_concept(text: str) -> Optional[str]:
     t = (text or "").lower()
     if "∃" in text or "exists" in t or "existential" in t:
@@ -150,6 +346,41 @@ def _curated_concept(text: str) -> Optional[str]:
         return "Syntax"
     return None
 
+def _clean_concept_name(name: str) -> str:
+    # Remove page markers, excessive digits, and repeated tokens
+    n = name.strip()
+    n = _PAGE_MARK_RE.sub("", n)  # remove tokens like P317
+    n = _NON_ALNUM_RE.sub("", n)
+    n = _WHITESPACE_RE.sub(" ", n)
+    tokens = n.split()
+    # drop single-letter or pure-digit tokens
+    tokens = [t for t in tokens if (len(t) > 1 and not t.isdigit())]
+    # dedupe consecutive tokens
+    dedup = []
+    for t in tokens:
+        if not dedup or dedup[-1].lower() != t.lower():
+            dedup.append(t)
+    n = " ".join(dedup)
+    return n.strip()[:80]
+
+_CURATED_DEFINITIONS = {
+    "Existential quantifier (∃)": "∃x P means there exists at least one object x such that P holds.",
+    "Universal quantifier (∀)": "∀x P means for all objects x in the domain, P holds.",
+    "First-order predicate calculus (FOPC)": "A logical system with quantifiers over objects, predicates, and variables for expressing statements about a domain.",
+    "Models in FOPC": "An interpretation assigning a domain and meanings to predicates/functions so formulas have truth values.",
+    "Domain of discourse": "The set of objects that variables range over in a logical interpretation.",
+    "Resolution": "A rule of inference used for automated reasoning by deriving contradictions to prove statements.",
+    "Unification": "The process of making two expressions identical by finding substitutions for variables.",
+    "Skolemization": "Eliminating existential quantifiers by introducing Skolem functions or constants.",
+    "Knowledge representation": "Techniques to encode information about the world in a form that a computer can utilize to solve complex tasks.",
+    "Semantics": "The meaning of symbols and formulas; how interpretations assign truth values.",
+    "Syntax": "The formal structure and rules for forming well-constructed expressions and formulas."
+}
+
+_FALLBACK_MCQ_TEXT = "Based on the material, which concept is most emphasized?"
+_FALLBACK_MCQ_OPTIONS = ("A. The first principle", "B. The second principle", "C. The third principle", "D. All of the above")
+_FALLBACK_MCQ_SOLUTION = "The correct answer is D because all principles are equally important."
+
 
 class DeepSeekGenerator:
     
@@ -157,167 +388,522 @@ class DeepSeekGenerator:
         self.api_key = os.environ.get("DEEPSEEK_API_KEY")
         self.model = "deepseek-chat"
         self._session = None
+        self._connector: Optional[aiohttp.TCPConnector] = None
+        # Set once on the session instead of being rebuilt for every request
+        self._default_headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        self._session_lock = asyncio.Lock()
+        self._sem = asyncio.Semaphore(int(os.environ.get("DEEPSEEK_MAX_CONCURRENCY", "16")))
+        self._cache: "OrderedDict[bytes, Tuple[float, str]]" = OrderedDict()
+        self._chunk_fmt_cache: Dict[Tuple[str, int], str] = {}
+        self._ctx_cache: "OrderedDict[Tuple[Tuple[str, int], ...], str]" = OrderedDict()
+        self._concepts_cache: "OrderedDict[Tuple[Tuple[str, int], ...], Tuple[float, List[Dict]]]" = OrderedDict()
+        self._disk_cache: Optional[sqlite3.Connection] = None
+        self._disk_cache_writes = 0
+        # The disk cache is used from worker threads, one call at a time
+        self._disk_cache_lock = threading.Lock()
+        # Private generator for question sampling, separate from the shared module state
+        self._rng = random.Random()
+    
+    @staticmethod
+    def _cache_key(*parts: str) -> bytes:
+        # Parts are hashed incrementally rather than joined into one large
+        # string first; the NUL separators keep keys identical to a joined hash
+        h = hashlib.blake2b(digest_size=16)
+        for i, part in enumerate(parts):
+            if i:
+                h.update(b"\0")
+            h.update(part.encode())
+        return h.digest()
+    
+    def _cache_get(self, key: bytes) -> Optional[str]:
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        expires_at, content = entry
+        if time.monotonic() >= expires_at:
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return content
+    
+    def _cache_put(self, key: bytes, content: str):
+        self._cache[key] = (time.monotonic() + RESPONSE_CACHE_TTL, content)
+        self._cache.move_to_end(key)
+        while len(self._cache) > RESPONSE_CACHE_SIZE:
+            self._cache.popitem(last=False)
+    
+    def _get_disk_cache(self) -> Optional[sqlite3.Connection]:
+        if self._disk_cache is None:
+            try:
+                os.makedirs(os.path.dirname(DISK_CACHE_PATH), exist_ok=True)
+                conn = sqlite3.connect(DISK_CACHE_PATH, check_same_thread=False)
+                # WAL with synchronous=NORMAL keeps commits off the fsync path;
+                # a crash can lose only the latest cached replies
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                conn.execute("CREATE TABLE IF NOT EXISTS c(k BLOB PRIMARY KEY, v BLOB, ts REAL)")
+                conn.execute("CREATE INDEX IF NOT EXISTS c_ts ON c(ts)")
+                self._prune_disk_cache(conn)
+                self._disk_cache = conn
+            except sqlite3.Error as e:
+                logger.warning("DeepSeek disk cache unavailable: %s", e)
+                return None
+        return self._disk_cache
+    
+    @staticmethod
+    def _prune_disk_cache(conn: sqlite3.Connection):
+        conn.execute("DELETE FROM c WHERE ts < ?", (time.time() - DISK_CACHE_MAX_AGE,))
+        conn.execute(
+            "DELETE FROM c WHERE k IN (SELECT k FROM c ORDER BY ts DESC LIMIT -1 OFFSET ?)",
+            (DISK_CACHE_MAX_ROWS,)
+        )
+        conn.commit()
+    
+    def _disk_cache_get(self, key: bytes) -> Optional[str]:
+        # Blocking; called through asyncio.to_thread
+        with self._disk_cache_lock:
+            conn = self._get_disk_cache()
+            if conn is None:
+                return None
+            try:
+                row = conn.execute("SELECT v FROM c WHERE k = ?", (key,)).fetchone()
+            except sqlite3.Error as e:
+                logger.warning("DeepSeek disk cache read failed: %s", e)
+                return None
+            return row[0].decode() if row else None
+    
+    def _disk_cache_put(self, key: bytes, content: str):
+        # Blocking; called through asyncio.to_thread
+        with self._disk_cache_lock:
+            conn = self._get_disk_cache()
+            if conn is None:
+                return
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO c(k, v, ts) VALUES (?, ?, ?)",
+                    (key, content.encode(), time.time())
+                )
+                conn.commit()
+                self._disk_cache_writes += 1
+                if self._disk_cache_writes % DISK_CACHE_PRUNE_EVERY == 0:
+                    self._prune_disk_cache(conn)
+            except sqlite3.Error as e:
+                logger.warning("DeepSeek disk cache write failed: %s", e)
+    
+    def _close_disk_cache(self):
+        with self._disk_cache_lock:
+            if self._disk_cache is not None:
+                self._disk_cache.close()
+                self._disk_cache = None
     
     async def _get_session(self) -> aiohttp.ClientSession:
-        if self._session is None or self._session.closed:
-            self._session = aiohttp.ClientSession()
+        if self._session is not None and not self._session.closed:
+            return self._session
+        async with self._session_lock:
+            if self._session is None or self._session.closed:
+                # One pooled session for the process: keeps TLS connections to
+                # the API alive and caches DNS instead of reconnecting per call
+                self._connector = aiohttp.TCPConnector(
+                    limit=100,
+                    limit_per_host=32,
+                    keepalive_timeout=75,
+                    ttl_dns_cache=300,
+                    enable_cleanup_closed=True
+                )
+                self._session = aiohttp.ClientSession(
+                    connector=self._connector,
+                    headers=self._default_headers,
+                    timeout=aiohttp.ClientTimeout(total=60, connect=10),
+                    read_bufsize=4 * 1024 * 1024
+                )
         return self._session
     
-    async def _call_deepseek(self, prompt: str, max_retries: int = 1) -> Optional[str]:
-        if not self.api_key:
-            logger.warning("No DeepSeek API key found")
-            return None
-        
-        session = await self._get_session()
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        
+    def _build_payload(
+        self,
+        prompt: str,
+        instructions: Optional[str],
+        max_tokens: int,
+        temperature: float = 0.7,
+        tool: Optional[Dict] = None
+    ) -> Dict:
+        system_content = _system_content(instructions)
         payload = {
             "model": self.model,
             "messages": [
-                {"role": "system", "content": "You are a helpful assistant that outputs only valid JSON."},
+                {"role": "system", "content": system_content},
                 {"role": "user", "content": prompt}
             ],
-            "temperature": 0.7,
-            "max_tokens": 2000,
-            "response_format": {"type": "json_object"}
+            "temperature": temperature,
+            "max_tokens": max_tokens
         }
+        if tool:
+            payload["tools"] = [tool]
+            payload["tool_choice"] = {
+                "type": "function",
+                "function": {"name": tool["function"]["name"]}
+            }
+        else:
+            payload["response_format"] = {"type": "json_object"}
+        return payload
+    
+    async def _call_deepseek(
+        self,
+        prompt: str,
+        max_retries: int = DEEPSEEK_MAX_RETRIES,
+        use_cache: bool = True,
+        instructions: Optional[str] = None,
+        max_tokens: int = 2000,
+        temperature: float = 0.7,
+        tool: Optional[Dict] = None,
+        cache_text: Optional[str] = None
+    ) -> Optional[str]:
+        if not self.api_key:
+            logger.warning("No DeepSeek API key found")
+            return None
         
+        # The prompt embeds the context and, for grading, the student answer,
+        # so an identical prompt can safely reuse the previous completion.
+        # Callers may key on a normalized variant of the prompt via cache_text.
+        cache_key = (
+            self._cache_key(
+                str(temperature),
+                tool["function"]["name"] if tool else "",
+                instructions or "",
+                cache_text if cache_text is not None else prompt
+            )
+            if use_cache else None
+        )
+        # Deterministic (temperature 0) replies are also persisted across restarts
+        use_disk = cache_key is not None and temperature == 0
+        if cache_key is not None:
+            cached = self._cache_get(cache_key)
+            if cached is None and use_disk:
+                cached = await asyncio.to_thread(self._disk_cache_get, cache_key)
+                if cached is not None:
+                    self._cache_put(cache_key, cached)
+            if cached is not None:
+                return cached
+        
+        session = await self._get_session()
+        # Serialized once and reused by every retry
+        body = orjson.dumps(self._build_payload(prompt, instructions, max_tokens, temperature, tool))
+        
+        retry_after = None
         for attempt in range(max_retries):
+            if attempt > 0:
+                delay = 0.5 * (2 ** (attempt - 1)) + self._rng.random() * 0.2
+                if retry_after is not None:
+                    delay = max(delay, retry_after)
+                await asyncio.sleep(delay)
+                retry_after = None
             try:
-                async with session.post(
-                    DEEPSEEK_API_URL,
-                    headers=headers,
-                    json=payload,
-                    timeout=aiohttp.ClientTimeout(total=12)
-                ) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        content = data["choices"][0]["message"]["content"]
-                        return content
-                    else:
-                        error_text = await response.text()
-                        logger.error(f"DeepSeek API error {response.status}: {error_text}")
+                async with self._sem:
+                    async with session.post(DEEPSEEK_API_URL, data=body) as response:
+                        if response.status == 200:
+                            data = orjson.loads(await response.read())
+                            message = data["choices"][0]["message"]
+                            tool_calls = message.get("tool_calls") if tool else None
+                            if tool_calls:
+                                # Tool arguments are the schema-shaped JSON object
+                                content = tool_calls[0]["function"]["arguments"]
+                            else:
+                                content = message.get("content")
+                            if not content:
+                                logger.error("DeepSeek returned an empty completion")
+                                return None
+                            if cache_key is not None:
+                                self._cache_put(cache_key, content)
+                                if use_disk:
+                                    await asyncio.to_thread(self._disk_cache_put, cache_key, content)
+                            return content
+                        # The error body can be a large HTML page; skip reading it
+                        # when nothing would be logged
+                        if logger.isEnabledFor(logging.ERROR):
+                            logger.error("DeepSeek API error %s: %s", response.status, await response.text())
+                        # Only rate limits and server errors are worth retrying
+                        if response.status != 429 and response.status < 500:
+                            break
+                        try:
+                            retry_after = min(float(response.headers["Retry-After"]), MAX_RETRY_AFTER)
+                        except (KeyError, ValueError):
+                            pass
             except Exception as e:
-                logger.error(f"DeepSeek request failed (attempt {attempt + 1}): {e}")
+                logger.error("DeepSeek request failed (attempt %d): %s", attempt + 1, e)
         
         return None
     
+    def _format_chunk(self, chunk: Dict) -> str:
+        get = chunk.get
+        chunk_id = get("chunk_id")
+        text = get("text", "")
+        # Keyed on the text length too, since trimmed copies share the chunk_id
+        cache_key = (chunk_id, len(text)) if chunk_id else None
+        if cache_key is not None:
+            cached = self._chunk_fmt_cache.get(cache_key)
+            if cached is not None:
+                return cached
+        formatted = (
+            f"File: {get('file_name', 'unknown')}\n"
+            f"Page: {get('page_number', get('page', 1))}\n"
+            f"Chunk ID: {chunk_id or 'unknown'}\n"
+            f"Content: {text[:CHUNK_TEXT_LIMIT]}\n"
+        )
+        if cache_key is not None:
+            self._chunk_fmt_cache[cache_key] = formatted
+            # Evict in insertion order so chunks of deleted courses age out
+            if len(self._chunk_fmt_cache) > CHUNK_FORMAT_CACHE_SIZE:
+                del self._chunk_fmt_cache[next(iter(self._chunk_fmt_cache))]
+        return formatted
+    
+    def _trim_chunks(self, chunks: List[Dict], max_chars: int = MAX_CONTEXT_CHARS) -> List[Dict]:
+        # Drop repeated chunks and keep the best-scored ones within a character
+        # budget, so prompt size (and prefill time) stays bounded
+        seen = set()
+        unique = []
+        for chunk in chunks:
+            chunk_id = chunk.get("chunk_id")
+            if chunk_id:
+                if chunk_id in seen:
+                    continue
+                seen.add(chunk_id)
+            unique.append(chunk)
+        if any("score" in chunk for chunk in unique):
+            unique.sort(key=lambda c: c.get("score") or 0.0, reverse=True)
+        trimmed = []
+        remaining = max_chars
+        for chunk in unique:
+            if remaining <= 0:
+                break
+            text = chunk.get("text", "")
+            size = min(len(text), CHUNK_TEXT_LIMIT)
+            if size > remaining:
+                chunk = {**chunk, "text": text[:remaining]}
+                size = remaining
+            trimmed.append(chunk)
+            remaining -= size
+        return trimmed
+    
     def _format_context(self, chunks: List[Dict]) -> str:
-        context_parts = []
-        for i, chunk in enumerate(chunks):
-            chunk_info = f"[CHUNK {i+1}]\n"
-            chunk_info += f"File: {chunk.get('file_name', 'unknown')}\n"
-            chunk_info += f"Page: {chunk.get('page_number', chunk.get('page', 1))}\n"
-            chunk_info += f"Chunk ID: {chunk.get('chunk_id', 'unknown')}\n"
-            chunk_info += f"Content: {chunk.get('text', '')[:800]}\n"
-            context_parts.append(chunk_info)
-        return "\n---\n".join(context_parts)
+        # Generation and grading in one round format the same chunk list, so
+        # whole contexts are memoized by their (chunk_id, text length) sequence
+        key = tuple((c.get("chunk_id") or "", len(c.get("text", ""))) for c in chunks)
+        cacheable = all(chunk_id for chunk_id, _ in key)
+        if cacheable:
+            cached = self._ctx_cache.get(key)
+            if cached is not None:
+                self._ctx_cache.move_to_end(key)
+                return cached
+        context = "\n---\n".join(
+            f"[CHUNK {i+1}]\n{self._format_chunk(chunk)}" for i, chunk in enumerate(chunks)
+        )
+        if cacheable:
+            self._ctx_cache[key] = context
+            if len(self._ctx_cache) > CONTEXT_CACHE_SIZE:
+                self._ctx_cache.popitem(last=False)
+        return context
     
     async def generate_question(
         self,
         chunks: List[Dict],
         question_types: List[QuestionType],
         difficulty: Difficulty,
-        topic: Optional[str] = None
+        topic: Optional[str] = None,
+        use_cache: bool = True
     ) -> Optional[GeneratedQuestion]:
         if not chunks:
             logger.warning("No chunks provided for question generation")
             return self._generate_fallback_question(chunks, question_types, difficulty)
         
-        concepts = await self.extract_concepts(chunks)
+        chunks = self._trim_chunks(chunks)
+        # Too little material for the LLM to write a grounded problem from
+        if sum(len(c.get("text", "")) for c in chunks) < MIN_LLM_CONTEXT_CHARS:
+            return self._generate_fallback_question(chunks, question_types, difficulty)
+        # The concept list and the LLM-written problem don't depend on each
+        # other, so both requests run at once; the problem wins when valid
+        concepts_task = asyncio.create_task(self.extract_concepts(chunks))
+        try:
+            question = await self._generate_llm_question(chunks, question_types, difficulty, use_cache)
+        except BaseException:
+            concepts_task.cancel()
+            raise
+        if question is not None:
+            concepts_task.cancel()
+            return question
+        concepts = await concepts_task
         if concepts:
-            concept = random.choice(concepts)
-            if question_types and QuestionType.SHORT in question_types:
-                q_type = QuestionType.SHORT
-            elif question_types and QuestionType.MCQ in question_types:
-                q_type = QuestionType.MCQ
-            else:
-                q_type = QuestionType.SHORT
-            base_chunk = chunks[0]
-            source_chunks = [SourceChunk(
-                doc_id=base_chunk.get("doc_id", ""),
-                file_name=base_chunk.get("file_name", ""),
-                page=base_chunk.get("page_number", base_chunk.get("page", 1)),
-                chunk_id=base_chunk.get("chunk_id", ""),
-                char_start=base_chunk.get("char_start", 0),
-                char_end=base_chunk.get("char_end", 0),
-                text=base_chunk.get("text", "")[:200]
-            )]
-            if q_type == QuestionType.MCQ:
-                opts = [
-                    f"A. {concept['summary']}",
-                    "B. A tangential topic",
-                    "C. An unrelated definition",
-                    "D. None of the above"
-                ]
-                return GeneratedQuestion(
-                    question_id=str(uuid.uuid4()),
-                    question_text=f"Which option best defines the concept '{concept['name']}'?",
-                    question_type=q_type,
-                    options=opts,
-                    correct_answer="A",
-                    solution_steps="Choose the option that matches the concept definition.",
-                    source_chunks=source_chunks
-                )
+            return self._concept_question(concepts, chunks, question_types)
+        return self._generate_fallback_question(chunks, question_types, difficulty)
+    
+    async def _generate_llm_question(
+        self,
+        chunks: List[Dict],
+        question_types: List[QuestionType],
+        difficulty: Difficulty,
+        use_cache: bool = True
+    ) -> Optional[GeneratedQuestion]:
+        context = self._format_context(chunks)
+        types_str = _types_str(tuple(question_types))
+        prompt = _render(
+            _GEN_SEGMENTS,
+            context=context,
+            question_types=types_str,
+            difficulty=difficulty.value
+        )
+        # Hard problems are regenerated on every call so they stay fresh
+        response = await self._call_deepseek(
+            prompt,
+            use_cache=use_cache and difficulty != Difficulty.HARD,
+            instructions=GENERATE_PROBLEM_PROMPT,
+            tool=EMIT_QUESTION_TOOL
+        )
+        if response and not _is_complete_json(response):
+            logger.warning("Truncated DeepSeek response for question generation")
+            return None
+        if not response:
+            return None
+        # Decoding and model validation are CPU work; keep them off the loop
+        return await asyncio.to_thread(self._parse_generate, response, chunks, question_types)
+    
+    def _concept_question(
+        self,
+        concepts: List[Dict],
+        chunks: List[Dict],
+        question_types: List[QuestionType]
+    ) -> GeneratedQuestion:
+        concept = concepts[self._rng.randrange(len(concepts))]
+        if question_types and QuestionType.SHORT in question_types:
+            q_type = QuestionType.SHORT
+        elif question_types and QuestionType.MCQ in question_types:
+            q_type = QuestionType.MCQ
+        else:
+            q_type = QuestionType.SHORT
+        base_chunk = chunks[0]
+        source_chunks = [SourceChunk.from_chunk(base_chunk, text_limit=200)]
+        if q_type == QuestionType.MCQ:
+            opts = [
+                f"A. {concept['summary']}",
+                "B. A tangential topic",
+                "C. An unrelated definition",
+                "D. None of the above"
+            ]
             return GeneratedQuestion(
-                question_id=str(uuid.uuid4()),
-                question_text=f"Explain the concept: '{concept['name']}'.",
+                question_id=_qid(),
+                question_text=f"Which option best defines the concept '{concept['name']}'?",
                 question_type=q_type,
-                options=None,
-                correct_answer=concept['summary'],
-                solution_steps="Name the concept and give its concise definition and role.",
+                options=opts,
+                correct_answer="A",
+                solution_steps="Choose the option that matches the concept definition.",
                 source_chunks=source_chunks
             )
-        context = self._format_context(chunks)
-        types_str = ", ".join([qt.value for qt in question_types])
-        prompt = GENERATE_PROBLEM_PROMPT.format(
-            question_types=types_str,
-            difficulty=difficulty.value,
-            context=context
+        return GeneratedQuestion(
+            question_id=_qid(),
+            question_text=f"Explain the concept: '{concept['name']}'.",
+            question_type=q_type,
+            options=None,
+            correct_answer=concept['summary'],
+            solution_steps="Name the concept and give its concise definition and role.",
+            source_chunks=source_chunks
         )
-        response = await self._call_deepseek(prompt, max_retries=1)
-        if response:
-            try:
-                data = json.loads(response)
-                source_chunks = []
-                for sc in data.get("source_chunks", []):
-                    source_chunks.append(SourceChunk(
-                        doc_id=sc.get("doc_id", ""),
-                        file_name=sc.get("file_name", ""),
-                        page=sc.get("page", 1),
-                        chunk_id=sc.get("chunk_id", ""),
-                        char_start=0,
-                        char_end=0
-                    ))
-                if not source_chunks and chunks:
-                    for chunk in chunks[:2]:
-                        source_chunks.append(SourceChunk(
-                            doc_id=chunk.get("doc_id", ""),
-                            file_name=chunk.get("file_name", ""),
-                            page=chunk.get("page_number", chunk.get("page", 1)),
-                            chunk_id=chunk.get("chunk_id", ""),
-                            char_start=chunk.get("char_start", 0),
-                            char_end=chunk.get("char_end", 0),
-                            text=chunk.get("text", "")[:200]
-                        ))
-                q_type = data.get("question_type", "short")
-                if q_type not in [qt.value for qt in QuestionType]:
-                    q_type = question_types[0].value if question_types else "short"
-                return GeneratedQuestion(
-                    question_id=data.get("question_id", str(uuid.uuid4())),
-                    question_text=data.get("question_text", ""),
-                    question_type=QuestionType(q_type),
-                    options=data.get("options"),
-                    correct_answer=str(data.get("correct_answer", "")),
-                    solution_steps=data.get("solution_steps", ""),
-                    source_chunks=source_chunks
-                )
-            except json.JSONDecodeError as e:
-                logger.error(f"Failed to parse DeepSeek response: {e}")
-        return self._generate_fallback_question(chunks, question_types, difficulty)
+    
+    def _parse_generate(
+        self,
+        response: str,
+        chunks: List[Dict],
+        question_types: List[QuestionType]
+    ) -> Optional[GeneratedQuestion]:
+        try:
+            data = orjson.loads(response)
+            return self._question_from_data(data, chunks, question_types)
+        except (ValueError, TypeError, AttributeError) as e:
+            # Also covers valid JSON of the wrong shape; ValidationError and
+            # JSONDecodeError are both ValueErrors
+            logger.error("Failed to parse DeepSeek response: %s", e)
+            return None
+    
+    def _question_from_data(
+        self,
+        data: Dict,
+        chunks: List[Dict],
+        question_types: List[QuestionType]
+    ) -> GeneratedQuestion:
+        source_chunks = [
+            SourceChunk(
+                doc_id=sc.get("doc_id", ""),
+                file_name=sc.get("file_name", ""),
+                page=sc.get("page", 1),
+                chunk_id=sc.get("chunk_id", ""),
+                char_start=0,
+                char_end=0
+            )
+            for sc in data.get("source_chunks", [])
+        ]
+        if not source_chunks and chunks:
+            source_chunks = [SourceChunk.from_chunk(chunk, text_limit=200) for chunk in chunks[:2]]
+        q_type = data.get("question_type", "short")
+        if not isinstance(q_type, str) or q_type not in _QTYPE_VALUES:
+            q_type = question_types[0].value if question_types else "short"
+        return GeneratedQuestion(
+            question_id=data.get("question_id") or _qid(),
+            question_text=data.get("question_text", ""),
+            question_type=_QTYPE_BY_VALUE[q_type],
+            options=data.get("options"),
+            correct_answer=str(data.get("correct_answer", "")),
+            solution_steps=data.get("solution_steps", ""),
+            source_chunks=source_chunks
+        )
+    
+    async def generate_questions_batch(
+        self,
+        chunks: List[Dict],
+        question_types: List[QuestionType],
+        difficulty: Difficulty,
+        n: int
+    ) -> List[GeneratedQuestion]:
+        if n <= 0:
+            return []
+        questions: List[GeneratedQuestion] = []
+        chunks = self._trim_chunks(chunks)
+        if chunks:
+            # One request for all n problems shares the context across them
+            prompt = _render(
+                _GEN_BATCH_SEGMENTS,
+                context=self._format_context(chunks),
+                question_types=_types_str(tuple(question_types)),
+                difficulty=difficulty.value,
+                count=n
+            )
+            response = await self._call_deepseek(
+                prompt,
+                use_cache=difficulty != Difficulty.HARD,
+                instructions=GENERATE_PROBLEMS_BATCH_PROMPT,
+                max_tokens=min(2000 * n, MAX_OUTPUT_TOKENS)
+            )
+            if response and not _is_complete_json(response):
+                logger.warning("Truncated DeepSeek response for batch generation")
+                response = None
+            if response:
+                try:
+                    data = orjson.loads(response)
+                    items = data.get("questions") if isinstance(data, dict) else None
+                    for item in (items or [])[:n]:
+                        if isinstance(item, dict):
+                            questions.append(self._question_from_data(item, chunks, question_types))
+                except (ValueError, TypeError, AttributeError) as e:
+                    logger.error("Failed to parse DeepSeek batch response: %s", e)
+                    questions = []
+        # The prompt is identical on every pass, so only the first may come
+        # from the response cache; later ones would repeat its question
+        first = True
+        while len(questions) < n:
+            question = await self.generate_question(chunks, question_types, difficulty, use_cache=first)
+            first = False
+            if question is None:
+                break
+            questions.append(question)
+        return questions
     
     def _generate_fallback_question(
         self,
@@ -334,13 +920,13 @@ class DeepSeekGenerator:
             q_type = QuestionType.SHORT
         
         if chunks:
-            chunk = random.choice(chunks)
+            chunk = chunks[self._rng.randrange(len(chunks))]
             text_snippet = chunk.get("text", "")[:280]
             source_chunks = [SourceChunk(
                 doc_id=chunk.get("doc_id", ""),
                 file_name=chunk.get("file_name", "sample.txt"),
                 page=chunk.get("page_number", 1),
-                chunk_id=chunk.get("chunk_id", str(uuid.uuid4())),
+                chunk_id=chunk.get("chunk_id") or _qid(),
                 char_start=chunk.get("char_start", 0),
                 char_end=chunk.get("char_end", 280),
                 text=text_snippet
@@ -351,20 +937,22 @@ class DeepSeekGenerator:
         
         if q_type == QuestionType.MCQ:
             return GeneratedQuestion(
-                question_text=f"Based on the material, which concept is most emphasized?",
+                question_id=_qid(),
+                question_text=_FALLBACK_MCQ_TEXT,
                 question_type=q_type,
-                options=["A. The first principle", "B. The second principle", "C. The third principle", "D. All of the above"],
+                options=list(_FALLBACK_MCQ_OPTIONS),
                 correct_answer="D",
-                solution_steps="The correct answer is D because all principles are equally important.",
+                solution_steps=_FALLBACK_MCQ_SOLUTION,
                 source_chunks=source_chunks
             )
         elif q_type == QuestionType.CALC:
             # Only used when CALC is the only requested type
-            a = random.randint(10, 30)
-            b = random.randint(2, 9)
-            c = random.randint(10, 40)
+            a = self._rng.randrange(10, 31)
+            b = self._rng.randrange(2, 10)
+            c = self._rng.randrange(10, 41)
             calc_answer = str(a * b + c)
             return GeneratedQuestion(
+                question_id=_qid(),
                 question_text=f"Calculate: What is {a} * {b} + {c}?",
                 question_type=q_type,
                 options=None,
@@ -374,26 +962,14 @@ class DeepSeekGenerator:
             )
         else:
             concept = _curated_concept(text_snippet) or _extract_concept_name(text_snippet)
-            definitions = {
-                "Existential quantifier (∃)": "∃x P means there exists at least one object x such that P holds.",
-                "Universal quantifier (∀)": "∀x P means for all objects x in the domain, P holds.",
-                "First-order predicate calculus (FOPC)": "A logical system with quantifiers over objects, predicates, and variables for expressing statements about a domain.",
-                "Models in FOPC": "An interpretation assigning a domain and meanings to predicates/functions so formulas have truth values.",
-                "Domain of discourse": "The set of objects that variables range over in a logical interpretation.",
-                "Resolution": "A rule of inference used for automated reasoning by deriving contradictions to prove statements.",
-                "Unification": "The process of making two expressions identical by finding substitutions for variables.",
-                "Skolemization": "Eliminating existential quantifiers by introducing Skolem functions or constants.",
-                "Knowledge representation": "Techniques to encode information about the world in a form that a computer can utilize to solve complex tasks.",
-                "Semantics": "The meaning of symbols and formulas; how interpretations assign truth values.",
-                "Syntax": "The formal structure and rules for forming well-constructed expressions and formulas."
-            }
-            answer_text = definitions.get(concept, "Provide a concise definition and role of the concept.")
+            answer_text = _CURATED_DEFINITIONS.get(concept, "Provide a concise definition and role of the concept.")
             steps = (
                 f"1) Name the concept: {concept}\n"
                 f"2) Define it precisely\n"
                 f"3) Explain its role in the material"
             )
             return GeneratedQuestion(
+                question_id=_qid(),
                 question_text=f"Explain the concept: '{concept}'.",
                 question_type=q_type,
                 options=None,
@@ -403,56 +979,93 @@ class DeepSeekGenerator:
             )
     
     async def extract_concepts(self, chunks: List[Dict]) -> List[Dict]:
+        # Concepts depend only on which chunks are shown, so a repeat request
+        # for the same chunk set skips prompt building and the LLM call
+        key = tuple((c.get("chunk_id") or "", len(c.get("text", ""))) for c in chunks or [])
+        cacheable = bool(key) and all(chunk_id for chunk_id, _ in key)
+        if cacheable:
+            entry = self._concepts_cache.get(key)
+            if entry is not None:
+                if time.monotonic() < entry[0]:
+                    self._concepts_cache.move_to_end(key)
+                    return entry[1]
+                del self._concepts_cache[key]
         context = self._format_context(chunks) if chunks else ""
         if not context:
             return []
-        prompt = EXTRACT_CONCEPTS_PROMPT.format(context=context)
-        response = await self._call_deepseek(prompt, max_retries=1)
-        if not response:
+        prompt = _render(_EXTRACT_CONCEPTS_SEGMENTS, context=context)
+        response = await self._call_deepseek(
+            prompt,
+            instructions=EXTRACT_CONCEPTS_PROMPT,
+            max_tokens=CONCEPTS_MAX_TOKENS
+        )
+        if not response or not _is_complete_json(response):
             return []
         try:
-            data = json.loads(response)
+            data = orjson.loads(response)
             concepts = data.get("concepts") or []
             results = []
-            import re
-            def clean_name(name: str) -> str:
-                # Remove page markers, excessive digits, and repeated tokens
-                n = name.strip()
-                n = re.sub(r"\bP\d+\b", "", n)  # remove tokens like P317
-                n = re.sub(r"[^A-Za-z0-9\s\-]", "", n)
-                n = re.sub(r"\s+", " ", n)
-                tokens = n.split()
-                # drop single-letter or pure-digit tokens
-                tokens = [t for t in tokens if (len(t) > 1 and not t.isdigit())]
-                # dedupe consecutive tokens
-                dedup = []
-                for t in tokens:
-                    if not dedup or dedup[-1].lower() != t.lower():
-                        dedup.append(t)
-                n = " ".join(dedup)
-                return n.strip()[:80]
+            seen = set()
             for c in concepts:
-                raw_name = (c.get("name") or "").strip()
                 summary = (c.get("summary") or "").strip()
-                name = clean_name(raw_name)
+                if not summary:
+                    continue
+                name = _clean_concept_name(c.get("name") or "")
                 # basic validity checks
                 if not name or len(name.split()) < 2:
                     continue
-                if summary and len(summary) > 0:
-                    results.append({"name": name, "summary": summary})
-            # dedupe by name
-            seen = set()
-            deduped = []
-            for item in results:
-                key = item["name"].lower()
-                if key in seen:
+                # dedupe by name
+                name_key = name.lower()
+                if name_key in seen:
                     continue
-                seen.add(key)
-                deduped.append(item)
-            return deduped
-        except json.JSONDecodeError:
+                seen.add(name_key)
+                results.append({"name": name, "summary": summary})
+            if cacheable and results:
+                self._concepts_cache[key] = (time.monotonic() + RESPONSE_CACHE_TTL, results)
+                while len(self._concepts_cache) > CONTEXT_CACHE_SIZE:
+                    self._concepts_cache.popitem(last=False)
+            return results
+        except orjson.JSONDecodeError:
             return []
 
+    def _verify_mcq(
+        self,
+        chunks: List[Dict],
+        correct_answer: str,
+        student_answer: str
+    ) -> VerificationResult:
+        is_correct = _mcq_letter(student_answer) == _mcq_letter(correct_answer)
+        # Like the LLM grader, wrong answers carry no citation
+        citations = [SourceChunk.from_chunk(chunks[0])] if chunks and is_correct else []
+        
+        return VerificationResult(
+            correct=is_correct,
+            confidence=1.0,
+            explanation="Correct." if is_correct else "Incorrect.",
+            citation=citations
+        )
+    
+    def verify_mcq_fast(
+        self,
+        chunks: List[Dict],
+        correct_answer: str,
+        student_answer: str
+    ) -> VerificationResult:
+        # MCQ grading is a plain letter comparison, so callers that already know
+        # the question type can skip the coroutine entirely
+        return self._verify_mcq(chunks, correct_answer, student_answer)
+    
+    def verify_mcq_batch(
+        self,
+        student_answers: List[str],
+        correct_answers: List[str]
+    ) -> List[bool]:
+        # Grades a whole quiz's MCQs in one pass with no per-answer result objects
+        return [
+            _mcq_letter(s) == _mcq_letter(c)
+            for s, c in zip(student_answers, correct_answers)
+        ]
+    
     async def verify_answer(
         self,
         chunks: List[Dict],
@@ -462,70 +1075,66 @@ class DeepSeekGenerator:
         question_type: QuestionType
     ) -> VerificationResult:
         if question_type == QuestionType.MCQ:
-            student_clean = student_answer.strip().upper()
-            correct_clean = correct_answer.strip().upper()
-            
-            if len(student_clean) > 0:
-                student_clean = student_clean[0]
-            if len(correct_clean) > 0:
-                correct_clean = correct_clean[0]
-            
-            is_correct = student_clean == correct_clean
-            
-            citations = []
-            if chunks:
-                chunk = chunks[0]
-                citations.append(SourceChunk(
-                    doc_id=chunk.get("doc_id", ""),
-                    file_name=chunk.get("file_name", ""),
-                    page=chunk.get("page_number", chunk.get("page", 1)),
-                    chunk_id=chunk.get("chunk_id", ""),
-                    char_start=chunk.get("char_start", 0),
-                    char_end=chunk.get("char_end", 0)
-                ))
-            
+            return self._verify_mcq(chunks, correct_answer, student_answer)
+        # A blank answer can't be right, so don't spend a grader call on it
+        if not student_answer.strip():
             return VerificationResult(
-                correct=is_correct,
+                correct=False,
                 confidence=1.0,
-                explanation="Correct." if is_correct else "Incorrect.",
-                citation=citations
+                explanation="No answer given.",
+                citation=[]
             )
+        if question_type == QuestionType.CALC:
+            # Plain numeric answers are compared locally; anything else
+            # (fractions, units, expressions) still goes to the LLM grader
+            expected = _parse_number(correct_answer)
+            given = _parse_number(student_answer)
+            if expected is not None and given is not None:
+                is_correct = math.isclose(expected, given, rel_tol=1e-6, abs_tol=1e-9)
+                return VerificationResult(
+                    correct=is_correct,
+                    confidence=1.0,
+                    explanation="Correct." if is_correct else "Incorrect.",
+                    citation=[SourceChunk.from_chunk(chunks[0])] if chunks and is_correct else []
+                )
         
+        chunks = self._trim_chunks(chunks)
         context = self._format_context(chunks) if chunks else "No context available"
         
-        prompt = VERIFY_ANSWER_PROMPT.format(
+        prompt = _render(
+            _VERIFY_SEGMENTS,
             context=context,
             solution=solution,
             correct_answer=correct_answer,
             student_answer=student_answer
         )
+        cache_text = _render(
+            _VERIFY_SEGMENTS,
+            context=context,
+            solution=solution,
+            correct_answer=correct_answer,
+            student_answer=_normalize_free_text(
+                student_answer,
+                case_sensitive=question_type == QuestionType.CODE
+            )
+        )
         
-        response = await self._call_deepseek(prompt)
+        # Grading should be deterministic, which also makes replies safe to persist
+        response = await self._call_deepseek(
+            prompt,
+            instructions=VERIFY_ANSWER_PROMPT,
+            temperature=0.0,
+            tool=EMIT_VERIFICATION_TOOL,
+            cache_text=cache_text
+        )
+        if response and not _is_complete_json(response):
+            logger.warning("Truncated DeepSeek response for answer verification")
+            response = None
         
         if response:
-            try:
-                data = json.loads(response)
-                
-                citations = []
-                for c in data.get("citation", []):
-                    citations.append(SourceChunk(
-                        doc_id=c.get("doc_id", ""),
-                        file_name=c.get("file_name", ""),
-                        page=c.get("page", 1),
-                        chunk_id=c.get("chunk_id", ""),
-                        char_start=0,
-                        char_end=0
-                    ))
-                
-                is_correct = bool(data.get("correct", False))
-                return VerificationResult(
-                    correct=is_correct,
-                    confidence=float(data.get("confidence", 0.5)),
-                    explanation="Correct." if is_correct else "Incorrect.",
-                    citation=citations if is_correct else []
-                )
-            except json.JSONDecodeError as e:
-                logger.error(f"Failed to parse verification response: {e}")
+            verification = await asyncio.to_thread(self._parse_verify, response)
+            if verification is not None:
+                return verification
         
         student_lower = student_answer.lower().strip()
         correct_lower = correct_answer.lower().strip()
@@ -539,67 +1148,104 @@ class DeepSeekGenerator:
             citation=[]
         )
 
+    def _parse_verify(self, response: str) -> Optional[VerificationResult]:
+        try:
+            data = orjson.loads(response)
+            
+            citations = [
+                SourceChunk(
+                    doc_id=c.get("doc_id", ""),
+                    file_name=c.get("file_name", ""),
+                    page=c.get("page", 1),
+                    chunk_id=c.get("chunk_id", ""),
+                    char_start=0,
+                    char_end=0
+                )
+                for c in data.get("citation", [])
+            ]
+            
+            is_correct = bool(data.get("correct", False))
+            return VerificationResult(
+                correct=is_correct,
+                confidence=float(data.get("confidence", 0.5)),
+                explanation="Correct." if is_correct else "Incorrect.",
+                citation=citations if is_correct else []
+            )
+        except (ValueError, TypeError, AttributeError) as e:
+            logger.error("Failed to parse verification response: %s", e)
+            return None
+
     async def answer_question(
         self,
         chunks: List[Dict],
         question: str
     ) -> Dict:
+        chunks = self._trim_chunks(chunks)
         context = self._format_context(chunks) if chunks else "No context available"
-        prompt = ANSWER_QA_PROMPT.format(context=context, question=question)
-        response = await self._call_deepseek(prompt, max_retries=1)
+        prompt = _render(_ANSWER_QA_SEGMENTS, context=context, question=question)
+        cache_text = _render(
+            _ANSWER_QA_SEGMENTS,
+            context=context,
+            question=_normalize_free_text(question)
+        )
+        response = await self._call_deepseek(
+            prompt,
+            instructions=ANSWER_QA_PROMPT,
+            cache_text=cache_text
+        )
         if response:
             try:
-                data = json.loads(response)
-                citations = []
-                for c in data.get("citation", []):
-                    citations.append(SourceChunk(
+                data = orjson.loads(response)
+                citations = [
+                    SourceChunk(
                         doc_id=c.get("doc_id", ""),
                         file_name=c.get("file_name", ""),
                         page=c.get("page", 1),
                         chunk_id=c.get("chunk_id", ""),
                         char_start=0,
                         char_end=0
-                    ))
+                    )
+                    for c in data.get("citation", [])
+                ]
                 ans = (data.get("answer", "") or "").strip()
                 if not ans:
                     # provide concise fallback from top chunk
                     if chunks:
                         snippet = chunks[0].get("text", "").strip()[:300]
                         ans = snippet or "No context available"
-                        citations = [SourceChunk(
-                            doc_id=chunks[0].get("doc_id", ""),
-                            file_name=chunks[0].get("file_name", ""),
-                            page=chunks[0].get("page_number", chunks[0].get("page", 1)),
-                            chunk_id=chunks[0].get("chunk_id", ""),
-                            char_start=chunks[0].get("char_start", 0),
-                            char_end=chunks[0].get("char_end", 0)
-                        )]
+                        citations = [SourceChunk.from_chunk(chunks[0])]
                     else:
                         ans = "No context available"
                 return {
                     "answer": ans,
                     "citation": citations
                 }
-            except json.JSONDecodeError:
+            except orjson.JSONDecodeError:
                 pass
         if chunks:
             snippet = chunks[0].get("text", "")[:300]
             return {
                 "answer": snippet,
-                "citation": [SourceChunk(
-                    doc_id=chunks[0].get("doc_id", ""),
-                    file_name=chunks[0].get("file_name", ""),
-                    page=chunks[0].get("page_number", chunks[0].get("page", 1)),
-                    chunk_id=chunks[0].get("chunk_id", ""),
-                    char_start=chunks[0].get("char_start", 0),
-                    char_end=chunks[0].get("char_end", 0)
-                )]
+                "citation": [SourceChunk.from_chunk(chunks[0])]
             }
         return {"answer": "No context available", "citation": []}
     
     async def close(self):
+        await asyncio.to_thread(self._close_disk_cache)
         if self._session and not self._session.closed:
             await self._session.close()
+            # Give the SSL transports a moment to shut down cleanly
+            await asyncio.sleep(0.25)
+        if self._connector is not None and not self._connector.closed:
+            await self._connector.close()
+        self._connector = None
+
+
+_generator: Optional[DeepSeekGenerator] = None
 
 
-generator = DeepSeekGenerator()
+def get_generator() -> DeepSeekGenerator:
+    global _generator
+    if _generator is None:
+        _generator = DeepSeekGenerator()
+    return _generator
@@ -3,11 +3,15 @@ import sys
 import time
 import uuid
 import random
-import json
+import orjson
+import atexit
+import queue
 import asyncio
 import logging
-from typing import Dict, List, Optional
+from logging.handlers import QueueHandler, QueueListener
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
 from contextlib import asynccontextmanager
+from concurrent.futures.process import BrokenProcessPool
 
 from dotenv import load_dotenv
 
@@ -20,7 +24,7 @@ elif os.path.exists(os.path.join(os.path.dirname(__file__), "..", ".env.example"
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, UploadFile, File, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response
 
 from models import (
     Match, Player, CurrentRound, GeneratedQuestion,
@@ -28,13 +32,19 @@ from models import (
     JoinMatchRequest, JoinMatchResponse,
     AnswerRequest, AnswerResponse,
     UploadResponse, QuestionType, Difficulty, SourceChunk,
-    ChatRequest, ChatResponse
+    ChatRequest, ChatResponse, AnswerOutcome
 )
 from storage import file_storage
 from rag import rag_pipeline
-from generator import generator
+from generator import get_generator
 
-logging.basicConfig(level=logging.INFO)
+# Records are queued on the event loop and written to stderr by a listener
+# thread, so slow log output never blocks request handling
+_log_queue: queue.SimpleQueue = queue.SimpleQueue()
+_log_listener = QueueListener(_log_queue, logging.StreamHandler())
+_log_listener.start()
+atexit.register(_log_listener.stop)
+logging.basicConfig(level=logging.INFO, handlers=[QueueHandler(_log_queue)])
 logger = logging.getLogger(__name__)
 
 HP_MAX = 100
@@ -42,10 +52,27 @@ BASE_DAMAGE = 20
 MAX_BONUS = 30
 TIMEOUT_PENALTY = 8
 COOLDOWN_SECONDS = 2
+OUTBOUND_QUEUE_SIZE = 256
+# Finished matches stay readable for a while; unjoined lobbies expire
+FINISHED_MATCH_TTL = 300
+WAITING_MATCH_TTL = 600
+MATCH_SWEEP_INTERVAL = 60
+# Concepts are re-extracted from a fresh sample after this long, for variety
+COURSE_CONCEPTS_TTL = 600
 
+# Match state and sockets are process-local: the server must run as a single
+# worker so both players of a match land on the same process
 matches: Dict[str, Match] = {}
-websocket_connections: Dict[str, Dict[str, WebSocket]] = {}
 round_timers: Dict[str, asyncio.Task] = {}
+next_question_tasks: Dict[str, asyncio.Task] = {}
+# course_id -> background embedding/indexing of a fresh upload
+indexing_tasks: Dict[str, asyncio.Task] = {}
+# Close handshakes for peers dropped by _enqueue, held until they finish
+closing_tasks: Set[asyncio.Task] = set()
+# (file_storage.version, encoded /api/courses body)
+courses_cache: Optional[Tuple[int, bytes]] = None
+# course_id -> (chunk mapping the concepts came from, expiry, concepts)
+course_concepts: Dict[str, Tuple[Dict[str, Dict], float, List[Dict]]] = {}
 
 
 @asynccontextmanager
@@ -54,25 +81,16 @@ async def lifespan(app: FastAPI):
     try:
         file_storage.load_existing_courses()
         logger.info(f"Loaded {len(file_storage.courses)} persisted courses")
-        # Populate retrieval chunk mappings from manifests
-        for cid, info in file_storage.courses.items():
-            chunks = info.get("chunks", [])
-            if chunks:
-                rag_pipeline.chunk_mappings[cid] = {}
-                for ch in chunks:
-                    rag_pipeline.chunk_mappings[cid][ch["chunk_id"]] = {
-                        "doc_id": ch["doc_id"],
-                        "file_name": ch["file_name"],
-                        "page_number": ch["page_number"],
-                        "chunk_id": ch["chunk_id"],
-                        "char_start": ch["char_start"],
-                        "char_end": ch["char_end"],
-                        "text": ch["text"],
-                    }
     except Exception as e:
         logger.warning(f"Failed to load existing courses: {e}")
+    janitor = asyncio.create_task(sweep_matches())
     yield
-    await generator.close()
+    await _cancel_and_wait(janitor)
+    for task in list(indexing_tasks.values()):
+        await _cancel_and_wait(task)
+    await rag_pipeline.cancel_reindexing()
+    await get_generator().close()
+    file_storage.close()
     logger.info("Study-Battle server shutdown")
 
 
@@ -104,79 +122,136 @@ def calculate_damage(time_limit: int, seconds_taken: float) -> int:
     return damage
 
 
+def _enqueue(match: Match, player_name: str, message_json: str):
+    conn = match.connections.get(player_name)
+    if conn is None:
+        return
+    ws, outbox = conn
+    try:
+        outbox.put_nowait(message_json)
+    except asyncio.QueueFull:
+        # A peer this far behind is effectively gone; drop it rather than
+        # buffer without bound. Removing the connection here means later
+        # broadcasts skip it instead of warning and closing it again.
+        logger.warning(f"Outbound queue full for {player_name}, disconnecting")
+        del match.connections[player_name]
+        task = asyncio.create_task(_close_slow_peer(player_name, ws))
+        closing_tasks.add(task)
+        task.add_done_callback(closing_tasks.discard)
+
+
+async def _close_slow_peer(player_name: str, websocket: WebSocket):
+    try:
+        await websocket.close(code=1008)
+    except Exception as e:
+        logger.warning(f"Failed to close connection for {player_name}: {e}")
+
+
+async def _drain_outbound(player_name: str, websocket: WebSocket, outbox: asyncio.Queue):
+    # Sole writer for one connection, so a slow peer only delays itself
+    try:
+        while True:
+            message_json = await outbox.get()
+            await websocket.send_text(message_json)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to send to {player_name}: {e}")
+
+
 async def broadcast_to_match(match_id: str, message: dict, exclude_player: str = None):
-    if match_id not in websocket_connections:
+    match = matches.get(match_id)
+    if match is None or not match.connections:
         return
     
-    message_json = json.dumps(message)
-    for player_name, ws in websocket_connections[match_id].items():
+    # Encoded once for every recipient; still sent as a text frame because the
+    # client JSON.parses event.data
+    message_json = orjson.dumps(message).decode()
+    for player_name in list(match.connections):
         if exclude_player and player_name == exclude_player:
             continue
-        try:
-            await ws.send_text(message_json)
-        except Exception as e:
-            logger.error(f"Failed to send to {player_name}: {e}")
+        _enqueue(match, player_name, message_json)
 
 
 async def send_to_player(match_id: str, player_name: str, message: dict):
-    if match_id in websocket_connections:
-        if player_name in websocket_connections[match_id]:
-            try:
-                await websocket_connections[match_id][player_name].send_text(json.dumps(message))
-            except Exception as e:
-                logger.error(f"Failed to send to {player_name}: {e}")
+    match = matches.get(match_id)
+    if match is not None:
+        _enqueue(match, player_name, orjson.dumps(message).decode())
+
+
+async def _cancel_and_wait(task: Optional[asyncio.Task]):
+    # Waiting for the cancelled task lets it unwind before the caller moves on
+    # and keeps its exception from going unretrieved. The round timer itself
+    # starts the next round, so a task never waits on itself.
+    if task is None or task is asyncio.current_task():
+        return
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        if asyncio.current_task().cancelling():
+            raise
+    except Exception as e:
+        logger.warning(f"Background task failed: {e}")
+
+
+async def forget_match(match_id: str):
+    matches.pop(match_id, None)
+    await _cancel_and_wait(round_timers.pop(match_id, None))
+    await _cancel_and_wait(next_question_tasks.pop(match_id, None))
+
+
+async def sweep_matches():
+    # Finished matches and abandoned lobbies would otherwise stay in memory
+    # for the life of the process
+    while True:
+        await asyncio.sleep(MATCH_SWEEP_INTERVAL)
+        now = time.time()
+        expired = [
+            match_id for match_id, match in matches.items()
+            if (match.status == "finished" and now - (match.ended_at or now) > FINISHED_MATCH_TTL)
+            or (match.status == "waiting" and not match.connections and now - match.created_at > WAITING_MATCH_TTL)
+        ]
+        for match_id in expired:
+            await forget_match(match_id)
+        if expired:
+            logger.info(f"Evicted {len(expired)} expired matches")
 
 
 async def run_round_timer(match_id: str):
-    if match_id not in matches:
+    match = matches.get(match_id)
+    if match is None:
         return
-    
-    match = matches[match_id]
     if not match.current_round:
         return
     
-    time_limit = match.current_round.time_limit
-    start_time = match.current_round.start_time
+    question_id = match.current_round.question_id
+    deadline = match.current_round.start_time + match.current_round.time_limit
     
-    while True:
-        await asyncio.sleep(1)
-        
-        if match_id not in matches:
-            break
-        
-        match = matches[match_id]
-        if not match.current_round or match.current_round.question_id != matches[match_id].current_round.question_id:
-            break
-        
-        elapsed = time.time() - start_time
-        seconds_left = max(0, int(time_limit - elapsed))
-        
-        await broadcast_to_match(match_id, {
-            "type": "round_update",
-            "data": {"seconds_left": seconds_left}
-        })
-        
-        if seconds_left <= 0:
-            await handle_round_timeout(match_id)
-            break
+    # Clients count down locally from round_start, so the server only needs
+    # to wake once, at the deadline
+    await asyncio.sleep(max(0, deadline - time.time()))
+    
+    match = matches.get(match_id)
+    if match and match.current_round and match.current_round.question_id == question_id:
+        await handle_round_timeout(match_id)
 
 
 async def handle_round_timeout(match_id: str):
-    if match_id not in matches:
+    match = matches.get(match_id)
+    if match is None:
         return
-    
-    match = matches[match_id]
     if not match.current_round:
         return
     
-    for player_name in match.players:
-        if not match.players[player_name].submitted_this_round:
-            match.players[player_name].hp = max(0, match.players[player_name].hp - TIMEOUT_PENALTY)
+    cr = match.current_round
+    match.current_round = None
+    for player_name, player in match.players.items():
+        if not player.submitted_this_round:
+            match.apply_damage(player_name, TIMEOUT_PENALTY)
     
-    question = match.current_round.question
+    question = cr.question
     
-    saved = file_storage.get_saved_files(match.course_id)
-    saved_map = {sf.get("file_name"): sf.get("saved_name") for sf in saved}
     await broadcast_to_match(match_id, {
         "type": "round_result",
         "data": {
@@ -185,20 +260,11 @@ async def handle_round_timeout(match_id: str):
             "damage": TIMEOUT_PENALTY,
             "solution": question.solution_steps,
             "correct_answer": question.correct_answer,
-            "citation": [
-                {
-                    "file_name": sc.file_name,
-                    "page": sc.page,
-                    "chunk_id": sc.chunk_id,
-                    "url": f"/files/{match.course_id}/{saved_map.get(sc.file_name, '')}#page={sc.page}" if saved_map.get(sc.file_name) else None
-                } for sc in question.source_chunks
-            ],
-            "players": {name: {"hp": p.hp} for name, p in match.players.items()}
+            "citation": cr.citation,
+            "players": match.hp_snapshot()
         }
     })
     
-    match.current_round = None
-    
     for player in match.players.values():
         player.submitted_this_round = False
     
@@ -211,27 +277,46 @@ async def handle_round_timeout(match_id: str):
         await start_new_round(match_id)
 
 
-async def start_new_round(match_id: str):
-    if match_id not in matches:
-        return
-    
-    match = matches[match_id]
-    
-    if match.status != "active":
+async def ensure_course_chunks(course_id: str):
+    # Persisted courses register their chunks for retrieval on first use
+    # instead of all being read at startup
+    if course_id in rag_pipeline.chunk_mappings:
         return
-    
+    chunks = await asyncio.to_thread(file_storage.get_course_chunks, course_id)
+    if chunks and course_id not in rag_pipeline.chunk_mappings:
+        rag_pipeline.register_chunks(course_id, chunks)
+
+
+async def get_course_concepts(course_id: str, chunks: List[Dict]) -> List[Dict]:
+    # One extraction serves every round of a course until the TTL passes or
+    # the course is re-indexed, instead of an LLM call per round
+    mapping = rag_pipeline.chunk_mappings.get(course_id)
+    entry = course_concepts.get(course_id)
+    if entry is not None and entry[0] is mapping and time.time() < entry[1]:
+        return entry[2]
+    concept_pool = chunks if len(chunks) <= 50 else random.sample(chunks, 50)
+    concepts = await get_generator().extract_concepts(concept_pool)
+    if concepts and mapping is not None:
+        course_concepts[course_id] = (mapping, time.time() + COURSE_CONCEPTS_TTL, concepts)
+    return concepts
+
+
+async def generate_round_question(match: Match) -> Optional[GeneratedQuestion]:
     chunks = rag_pipeline.get_all_chunks(match.course_id)
-    logger.info(f"round: fetching chunks for course {match.course_id}, count={len(chunks)}")
+    logger.info("round: fetching chunks for course %s, count=%d", match.course_id, len(chunks))
     
     sample = chunks
     if len(chunks) > 10:
         sample = random.sample(chunks, 10)
-    logger.info(f"round: generating question types={[qt.value for qt in match.question_types]} difficulty={match.difficulty.value}")
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(
+            "round: generating question types=%s difficulty=%s",
+            [qt.value for qt in match.question_types], match.difficulty.value
+        )
     # Try concept-driven question first to reduce repetitive short prompts
     question = None
     try:
-        concept_pool = chunks if len(chunks) <= 50 else random.sample(chunks, 50)
-        concepts = await generator.extract_concepts(concept_pool)
+        concepts = await get_course_concepts(match.course_id, chunks)
         if concepts:
             concept = random.choice(concepts)
             allowed = match.question_types or [QuestionType.SHORT, QuestionType.MCQ]
@@ -241,15 +326,7 @@ async def start_new_round(match_id: str):
                 non_calc = [t for t in allowed if t != QuestionType.CALC]
                 q_type = non_calc[0] if non_calc else (allowed[0] if allowed else QuestionType.SHORT)
             base_chunk = sample[0]
-            source_chunks = [SourceChunk(
-                doc_id=base_chunk.get("doc_id", ""),
-                file_name=base_chunk.get("file_name", ""),
-                page=base_chunk.get("page_number", base_chunk.get("page", 1)),
-                chunk_id=base_chunk.get("chunk_id", ""),
-                char_start=base_chunk.get("char_start", 0),
-                char_end=base_chunk.get("char_end", 0),
-                text=base_chunk.get("text", "")[:200]
-            )]
+            source_chunks = [SourceChunk.from_chunk(base_chunk, text_limit=200)]
             if q_type == QuestionType.MCQ:
                 others = [c for c in concepts if c is not concept]
                 random.shuffle(others)
@@ -284,11 +361,32 @@ async def start_new_round(match_id: str):
     except Exception as e:
         logger.warning(f"Concept-driven generation failed: {e}")
     if question is None:
-        question = await generator.generate_question(
+        question = await get_generator().generate_question(
             chunks=sample,
             question_types=match.question_types,
             difficulty=match.difficulty
         )
+    return question
+
+
+async def start_new_round(match_id: str):
+    match = matches.get(match_id)
+    if match is None:
+        return
+    
+    if match.status != "active":
+        return
+    
+    # Use the question prefetched during the previous round when it's ready
+    question = None
+    prefetch = next_question_tasks.pop(match_id, None)
+    if prefetch is not None and not prefetch.cancelled():
+        try:
+            question = await prefetch
+        except Exception as e:
+            logger.warning(f"Prefetched question failed: {e}")
+    if question is None:
+        question = await generate_round_question(match)
     
     if not question:
         await broadcast_to_match(match_id, {
@@ -298,13 +396,22 @@ async def start_new_round(match_id: str):
         return
     
     question.time_limit = match.time_limit_seconds
-    logger.info(f"round: generated question id={question.question_id} type={question.question_type.value}")
+    logger.info("round: generated question id=%s type=%s", question.question_id, question.question_type.value)
+    
+    # Grade against the chunks the question was generated from
+    verify_chunks = [
+        chunk for chunk in (
+            rag_pipeline.get_chunk_by_id(match.course_id, sc.chunk_id)
+            for sc in question.source_chunks
+        ) if chunk
+    ] or rag_pipeline.get_all_chunks(match.course_id)[:5]
     
     match.current_round = CurrentRound(
         question_id=question.question_id,
         question=question,
         start_time=time.time(),
-        time_limit=match.time_limit_seconds
+        time_limit=match.time_limit_seconds,
+        verify_chunks=verify_chunks
     )
     
     for player in match.players.values():
@@ -320,6 +427,8 @@ async def start_new_round(match_id: str):
         "question_type": question.question_type.value,
         "options": question.options,
         "time_limit": question.time_limit,
+        "start_time": match.current_round.start_time,
+        "seconds_left": question.time_limit,
         "citation": [
             {
                 "file_name": sc.file_name,
@@ -330,23 +439,27 @@ async def start_new_round(match_id: str):
         ]
     }
     
+    match.current_round.citation = question_data["citation"]
+    
     await broadcast_to_match(match_id, {
         "type": "round_start",
         "data": question_data
     })
     
-    if match_id in round_timers:
-        round_timers[match_id].cancel()
+    await _cancel_and_wait(round_timers.pop(match_id, None))
     
     round_timers[match_id] = asyncio.create_task(run_round_timer(match_id))
+    # Generate the next question while this round is played, so the next
+    # round can start without waiting on the LLM
+    next_question_tasks[match_id] = asyncio.create_task(generate_round_question(match))
 
 
 async def end_match(match_id: str):
-    if match_id not in matches:
+    match = matches.get(match_id)
+    if match is None:
         return
-    
-    match = matches[match_id]
     match.status = "finished"
+    match.ended_at = time.time()
     
     winner = None
     for name, player in match.players.items():
@@ -371,8 +484,8 @@ async def end_match(match_id: str):
         }
     })
     
-    if match_id in round_timers:
-        round_timers[match_id].cancel()
+    await _cancel_and_wait(round_timers.pop(match_id, None))
+    await _cancel_and_wait(next_question_tasks.pop(match_id, None))
 
 
 @app.post("/api/upload", response_model=UploadResponse)
@@ -380,35 +493,65 @@ async def upload_files(files: List[UploadFile] = File(...)):
     if not files:
         raise HTTPException(status_code=400, detail="No files provided")
     
-    file_data = []
-    for file in files:
-        content = await file.read()
-        file_data.append((file.filename, content, file.content_type))
+    # Hand over the spooled temp files so storage copies them to disk in chunks
+    file_data = [(file.filename, file.file, file.content_type) for file in files]
+    
+    try:
+        course_id, processed_files, chunks = await file_storage.save_and_process_files(file_data)
+    except BrokenProcessPool as e:
+        # Only this upload fails; the next one gets a fresh extraction pool
+        logger.error(f"File extraction crashed: {e}")
+        raise HTTPException(status_code=500, detail="File processing failed")
     
-    course_id, processed_files, chunks = await file_storage.save_and_process_files(file_data)
+    if not chunks:
+        return UploadResponse(course_id=course_id, files=processed_files, chunks_indexed=0)
     
-    if chunks:
-        indexed_count = await rag_pipeline.index_chunks(course_id, chunks)
-    else:
-        indexed_count = 0
+    # Chunks are usable for rounds straight away; embedding can take minutes
+    # for a large course, so it runs in the background
+    rag_pipeline.register_chunks(course_id, chunks)
+    indexing_tasks[course_id] = asyncio.create_task(index_course(course_id, chunks))
     
     return UploadResponse(
         course_id=course_id,
         files=processed_files,
-        chunks_indexed=indexed_count
+        chunks_indexed=0,
+        status="indexing"
     )
 
 
+async def index_course(course_id: str, chunks: List[Dict]):
+    try:
+        indexed_count = await rag_pipeline.index_chunks(course_id, chunks)
+        logger.info(f"Background indexing finished for course {course_id}: {indexed_count} chunks")
+    except Exception as e:
+        logger.error(f"Background indexing failed for course {course_id}: {e}")
+    finally:
+        indexing_tasks.pop(course_id, None)
+
+
+@app.get("/api/courses/{course_id}/index-status")
+async def get_index_status(course_id: str):
+    course_info = file_storage.get_course_info(course_id)
+    if not course_info:
+        raise HTTPException(status_code=404, detail="Course not found")
+    return {
+        "course_id": course_id,
+        "status": "indexing" if course_id in indexing_tasks else "ready",
+        "chunk_count": course_info.get("chunk_count", 0)
+    }
+
+
 @app.post("/api/chat", response_model=ChatResponse)
 async def chat(req: ChatRequest):
     course_info = file_storage.get_course_info(req.course_id)
     if not course_info:
         raise HTTPException(status_code=404, detail="Course not found")
+    await ensure_course_chunks(req.course_id)
     used = await rag_pipeline.retrieve(req.course_id, req.question, top_k=6)
     if not used:
         chunks = rag_pipeline.get_all_chunks(req.course_id)
         used = chunks[:6]
-    qa = await generator.answer_question(used, req.question)
+    qa = await get_generator().answer_question(used, req.question)
     return ChatResponse(answer=qa.get("answer", ""), citation=qa.get("citation", []))
 
 
@@ -419,6 +562,7 @@ async def create_match(request: CreateMatchRequest):
     course_info = file_storage.get_course_info(request.course_id)
     if not course_info:
         raise HTTPException(status_code=404, detail="Course not found")
+    await ensure_course_chunks(request.course_id)
     
     match = Match(
         match_id=match_id,
@@ -432,7 +576,6 @@ async def create_match(request: CreateMatchRequest):
     match.players[request.player_name] = Player(name=request.player_name)
     
     matches[match_id] = match
-    websocket_connections[match_id] = {}
     
     return CreateMatchResponse(
         match_id=match_id,
@@ -443,11 +586,10 @@ async def create_match(request: CreateMatchRequest):
 
 @app.post("/api/join-match", response_model=JoinMatchResponse)
 async def join_match(request: JoinMatchRequest):
-    if request.match_id not in matches:
+    match = matches.get(request.match_id)
+    if match is None:
         raise HTTPException(status_code=404, detail="Match not found")
     
-    match = matches[request.match_id]
-    
     if len(match.players) >= 2:
         raise HTTPException(status_code=400, detail="Match is full")
     
@@ -455,6 +597,8 @@ async def join_match(request: JoinMatchRequest):
         raise HTTPException(status_code=400, detail="Player name already taken")
     
     match.players[request.player_name] = Player(name=request.player_name)
+    first, second = match.players
+    match.opponent_of = {first: second, second: first}
     
     return JoinMatchResponse(
         success=True,
@@ -463,105 +607,123 @@ async def join_match(request: JoinMatchRequest):
     )
 
 
-@app.post("/api/answer", response_model=AnswerResponse)
-async def submit_answer(request: AnswerRequest):
-    if request.match_id not in matches:
-        raise HTTPException(status_code=404, detail="Match not found")
-    
-    match = matches[request.match_id]
+async def process_answer(
+    match_id: str,
+    player_name: str,
+    question_id: str,
+    answer_payload: str
+) -> AnswerOutcome:
+    # Shared by the HTTP route and the websocket handler; rejections come back
+    # as values so the websocket path skips exception unwinding
+    match = matches.get(match_id)
+    if match is None:
+        return AnswerOutcome(error="Match not found", status_code=404)
+    
+    player = match.players.get(player_name)
+    if player is None:
+        return AnswerOutcome(error="Player not in match", status_code=400)
+    
+    # Cheapest rejections first so spammed answers bail out immediately
+    if player.cooldown_until and time.time() < player.cooldown_until:
+        return AnswerOutcome(error="In cooldown", status_code=400)
     
-    if request.player_name not in match.players:
-        raise HTTPException(status_code=400, detail="Player not in match")
+    if player.submitted_this_round:
+        return AnswerOutcome(error="Already submitted this round", status_code=400)
     
     if not match.current_round:
-        raise HTTPException(status_code=400, detail="No active round")
-    
-    if match.current_round.question_id != request.question_id:
-        raise HTTPException(status_code=400, detail="Invalid question ID")
-    
-    player = match.players[request.player_name]
-    
-    if player.submitted_this_round:
-        raise HTTPException(status_code=400, detail="Already submitted this round")
+        return AnswerOutcome(error="No active round", status_code=400)
     
-    if player.cooldown_until and time.time() < player.cooldown_until:
-        raise HTTPException(status_code=400, detail="In cooldown")
+    if match.current_round.question_id != question_id:
+        return AnswerOutcome(error="Invalid question ID", status_code=400)
     
     question = match.current_round.question
     time_taken = time.time() - match.current_round.start_time
     
-    chunks = rag_pipeline.get_all_chunks(match.course_id)[:5]
-    
-    verification = await generator.verify_answer(
-        chunks=chunks,
-        correct_answer=question.correct_answer,
-        solution=question.solution_steps,
-        student_answer=request.answer_payload,
-        question_type=question.question_type
-    )
+    chunks = match.current_round.verify_chunks
     
-    opponent_name = [n for n in match.players.keys() if n != request.player_name][0]
+    if question.question_type == QuestionType.MCQ:
+        verification = get_generator().verify_mcq_fast(
+            chunks=chunks,
+            correct_answer=question.correct_answer,
+            student_answer=answer_payload
+        )
+    else:
+        # Claim the grading slot before the slow LLM call so a double
+        # submit can't be graded (and award damage) twice. Repeated answers
+        # are served from the generator's response cache.
+        if player.verifying:
+            return AnswerOutcome(error="Answer is already being graded", status_code=400)
+        player.verifying = True
+        try:
+            verification = await get_generator().verify_answer(
+                chunks=chunks,
+                correct_answer=question.correct_answer,
+                solution=question.solution_steps,
+                student_answer=answer_payload,
+                question_type=question.question_type
+            )
+        finally:
+            player.verifying = False
+        # The round may have ended or moved on while grading
+        if not match.current_round or match.current_round.question_id != question_id:
+            return AnswerOutcome(error="Round already ended", status_code=400)
+        if player.submitted_this_round:
+            return AnswerOutcome(error="Already submitted this round", status_code=400)
+    
+    opponent_name = match.opponent_of[player_name]
     
     if verification.correct:
+        # Claim the round before the first await, so an answer or skip that
+        # lands while the timer is cancelled finds it already over
+        cr = match.current_round
+        match.current_round = None
         player.submitted_this_round = True
-        damage = calculate_damage(match.current_round.time_limit, time_taken)
+        damage = calculate_damage(cr.time_limit, time_taken)
         
-        match.players[opponent_name].hp = max(0, match.players[opponent_name].hp - damage)
+        match.apply_damage(opponent_name, damage)
         
-        match.current_round.answers_received[request.player_name] = {
+        cr.answers_received[player_name] = {
             "correct": True,
             "time_taken": time_taken,
             "damage": damage
         }
         
-        if request.match_id in round_timers:
-            round_timers[request.match_id].cancel()
+        await _cancel_and_wait(round_timers.pop(match_id, None))
         
-        saved = file_storage.get_saved_files(match.course_id)
-        saved_map = {sf.get("file_name"): sf.get("saved_name") for sf in saved}
-        await broadcast_to_match(request.match_id, {
+        await broadcast_to_match(match_id, {
             "type": "round_result",
             "data": {
-                "winner_player": request.player_name,
+                "winner_player": player_name,
                 "loser_player": opponent_name,
                 "damage": damage,
                 "time_taken": round(time_taken, 2),
                 "solution": question.solution_steps,
                 "correct_answer": question.correct_answer,
-                "citation": [
-                    {
-                        "file_name": sc.file_name,
-                        "page": sc.page,
-                        "chunk_id": sc.chunk_id,
-                        "url": f"/files/{match.course_id}/{saved_map.get(sc.file_name, '')}#page={sc.page}" if saved_map.get(sc.file_name) else None
-                    } for sc in question.source_chunks
-                ],
-                "players": {name: {"hp": p.hp} for name, p in match.players.items()}
+                "citation": cr.citation,
+                "players": match.hp_snapshot()
             }
         })
         
-        match.current_round = None
-        
         game_over = any(p.hp <= 0 for p in match.players.values())
         
         if game_over:
-            await end_match(request.match_id)
+            await end_match(match_id)
         else:
             await asyncio.sleep(3)
-            await start_new_round(request.match_id)
+            await start_new_round(match_id)
         
-        return AnswerResponse(
+        return AnswerOutcome(response=AnswerResponse(
             correct=True,
             damage_dealt=damage,
             your_hp=player.hp,
             opponent_hp=match.players[opponent_name].hp,
             explanation=verification.explanation,
             citation=verification.citation
-        )
+        ))
     else:
         player.cooldown_until = time.time() + COOLDOWN_SECONDS
         
-        await send_to_player(request.match_id, request.player_name, {
+        await send_to_player(match_id, player_name, {
             "type": "answer_feedback",
             "data": {
                 "correct": False,
@@ -570,37 +732,53 @@ async def submit_answer(request: AnswerRequest):
             }
         })
         
-        return AnswerResponse(
+        return AnswerOutcome(response=AnswerResponse(
             correct=False,
             damage_dealt=0,
             your_hp=player.hp,
             opponent_hp=match.players[opponent_name].hp,
             explanation=verification.explanation,
             citation=verification.citation
-        )
+        ))
+
+
+@app.post("/api/answer", response_model=AnswerResponse)
+async def submit_answer(request: AnswerRequest):
+    outcome = await process_answer(
+        request.match_id,
+        request.player_name,
+        request.question_id,
+        request.answer_payload
+    )
+    if outcome.error is not None:
+        raise HTTPException(status_code=outcome.status_code, detail=outcome.error)
+    return outcome.response
 
 
 @app.get("/api/match/{match_id}")
 async def get_match_info(match_id: str):
-    if match_id not in matches:
+    match = matches.get(match_id)
+    if match is None:
         raise HTTPException(status_code=404, detail="Match not found")
-    
-    match = matches[match_id]
-    return {
+    return Response(orjson.dumps({
         "match_id": match.match_id,
         "status": match.status,
-        "players": {name: {"hp": p.hp} for name, p in match.players.items()},
+        "players": match.hp_snapshot(),
         "time_limit": match.time_limit_seconds,
         "winner": match.winner
-    }
+    }), media_type="application/json")
 
 
 @app.get("/api/courses")
 async def list_courses():
+    global courses_cache
+    # Every page that lists courses hits this; re-encode only when the set changes
+    if courses_cache is not None and courses_cache[0] == file_storage.version:
+        return Response(courses_cache[1], media_type="application/json")
     courses = []
     for course_id, info in file_storage.courses.items():
         files = info.get("files", [])
-        chunk_count = len(info.get("chunks", []))
+        chunk_count = info.get("chunk_count", 0)
         if not files or chunk_count == 0:
             continue
         courses.append({
@@ -608,7 +786,9 @@ async def list_courses():
             "files": files,
             "chunk_count": chunk_count
         })
-    return {"courses": courses}
+    body = orjson.dumps({"courses": courses})
+    courses_cache = (file_storage.version, body)
+    return Response(body, media_type="application/json")
 
 
 @app.get("/api/course-files/{course_id}")
@@ -620,13 +800,11 @@ async def list_course_files(course_id: str):
     files = []
     for sf in saved:
         original_name = sf.get("file_name", "")
-        chunks = info.get("chunks", [])
-        file_chunks = [ch for ch in chunks if ch.get("file_name") == original_name]
         files.append({
             "file_name": original_name,
             "url": f"/files/{course_id}/{sf.get('saved_name', '')}",
             "saved_name": sf.get('saved_name', ''),
-            "chunk_count": len(file_chunks)
+            "chunk_count": len(await asyncio.to_thread(file_storage.get_file_chunks, course_id, original_name))
         })
     return {"files": files}
 
@@ -636,18 +814,90 @@ async def course_file_details(course_id: str, saved_name: str):
     info = file_storage.get_course_info(course_id)
     if not info:
         raise HTTPException(status_code=404, detail="Course not found")
-    details = file_storage.get_file_details(course_id, saved_name)
+    details = await asyncio.to_thread(file_storage.get_file_details, course_id, saved_name)
     return details
 
 
 @app.delete("/api/course-file/{course_id}/{saved_name}")
 async def delete_course_file(course_id: str, saved_name: str):
-    ok = file_storage.delete_file(course_id, saved_name)
+    try:
+        ok = await asyncio.to_thread(file_storage.delete_file, course_id, saved_name)
+    except OSError as e:
+        logger.error(f"Failed to delete file {saved_name}: {e}")
+        raise HTTPException(status_code=500, detail="Course chunks could not be read")
     if not ok:
         raise HTTPException(status_code=404, detail="File not found")
     return {"success": True}
 
 
+async def _ws_submit_answer(match_id: str, player_name: str, data: dict):
+    outcome = await process_answer(
+        match_id,
+        player_name,
+        str(data.get("question_id", "")),
+        str(data.get("answer", ""))
+    )
+    if outcome.error is not None:
+        await send_to_player(match_id, player_name, {
+            "type": "error",
+            "data": {"message": outcome.error}
+        })
+
+
+async def _ws_skip_round(match_id: str, player_name: str, data: dict):
+    match = matches.get(match_id)
+    if not match or not match.current_round:
+        await send_to_player(match_id, player_name, {
+            "type": "error",
+            "data": {"message": "No active round"}
+        })
+        return
+    
+    cr = match.current_round
+    if player_name not in cr.skipped_by:
+        cr.skipped_by.append(player_name)
+        await broadcast_to_match(match_id, {
+            "type": "skip_update",
+            "data": {
+                "skipped_by": cr.skipped_by,
+                "total": len(match.players)
+            }
+        })
+    # If both players skipped, end round without damage. The round may have
+    # been won while the update went out; otherwise it is claimed before
+    # waiting on the timer so nothing else can end it too
+    if match.current_round is cr and len(cr.skipped_by) >= len(match.players):
+        match.current_round = None
+        await _cancel_and_wait(round_timers.pop(match_id, None))
+        # Include solution, correct answer and citations so players can review
+        question = cr.question
+        await broadcast_to_match(match_id, {
+            "type": "round_result",
+            "data": {
+                "skipped": True,
+                "damage": 0,
+                "solution": question.solution_steps,
+                "correct_answer": question.correct_answer,
+                "citation": cr.citation,
+                "players": match.hp_snapshot()
+            }
+        })
+        await asyncio.sleep(1)
+        await start_new_round(match_id)
+
+
+async def _ws_ping(match_id: str, player_name: str, data: dict):
+    await send_to_player(match_id, player_name, {"type": "pong"})
+
+
+# Client message type -> handler(match_id, player_name, data)
+WS_HANDLERS: Dict[str, Callable[[str, str, dict], Awaitable[None]]] = {
+    "submit_answer": _ws_submit_answer,
+    "skip_round": _ws_skip_round,
+    "ping": _ws_ping,
+}
+
+
 @app.websocket("/ws/{match_id}")
 async def websocket_endpoint(websocket: WebSocket, match_id: str):
     await websocket.accept()
@@ -655,56 +905,56 @@ async def websocket_endpoint(websocket: WebSocket, match_id: str):
     player_name = websocket.query_params.get("player")
     
     if not player_name:
-        await websocket.send_text(json.dumps({
+        await websocket.send_text(orjson.dumps({
             "type": "error",
             "data": {"message": "Player name required"}
-        }))
+        }).decode())
         await websocket.close()
         return
     
     if match_id not in matches:
-        await websocket.send_text(json.dumps({
+        await websocket.send_text(orjson.dumps({
             "type": "error",
             "data": {"message": "Match not found"}
-        }))
+        }).decode())
         await websocket.close()
         return
     
     match = matches[match_id]
     
     if player_name not in match.players:
-        await websocket.send_text(json.dumps({
+        await websocket.send_text(orjson.dumps({
             "type": "error",
             "data": {"message": "Player not in match"}
-        }))
+        }).decode())
         await websocket.close()
         return
     
-    if match_id not in websocket_connections:
-        websocket_connections[match_id] = {}
-    
-    websocket_connections[match_id][player_name] = websocket
+    outbox: asyncio.Queue = asyncio.Queue(maxsize=OUTBOUND_QUEUE_SIZE)
+    connections = match.connections
+    connections[player_name] = (websocket, outbox)
+    writer = asyncio.create_task(_drain_outbound(player_name, websocket, outbox))
     
-    await websocket.send_text(json.dumps({
+    await send_to_player(match_id, player_name, {
         "type": "connected",
         "data": {
             "player": player_name,
             "match_id": match_id,
-            "players": list(match.players.keys())
+            "players": list(match.players)
         }
-    }))
+    })
     
     # If match is already active, send ready state immediately
     if match.status == "active":
-        await websocket.send_text(json.dumps({
+        await send_to_player(match_id, player_name, {
             "type": "match_ready",
             "data": {
-                "players": {name: {"hp": p.hp} for name, p in match.players.items()}
+                "players": match.hp_snapshot()
             }
-        }))
+        })
         if match.current_round and match.current_round.question:
             q = match.current_round.question
-            await websocket.send_text(json.dumps({
+            await send_to_player(match_id, player_name, {
                 "type": "round_start",
                 "data": {
                     "question_id": q.question_id,
@@ -712,23 +962,19 @@ async def websocket_endpoint(websocket: WebSocket, match_id: str):
                     "question_type": q.question_type.value,
                     "options": q.options,
                     "time_limit": q.time_limit,
-                    "citation": [
-                        {
-                            "file_name": sc.file_name,
-                            "page": sc.page,
-                            "chunk_id": sc.chunk_id
-                        } for sc in q.source_chunks
-                    ]
+                    "start_time": match.current_round.start_time,
+                    "seconds_left": max(0, int(match.current_round.start_time + match.current_round.time_limit - time.time())),
+                    "citation": match.current_round.citation
                 }
-            }))
+            })
     # Otherwise check if we now have 2 players to start the match
-    elif len(websocket_connections[match_id]) == 2 and match.status == "waiting":
+    elif len(match.connections) == 2 and match.status == "waiting":
         match.status = "active"
         
         await broadcast_to_match(match_id, {
             "type": "match_ready",
             "data": {
-                "players": {name: {"hp": p.hp} for name, p in match.players.items()}
+                "players": match.hp_snapshot()
             }
         })
         
@@ -738,81 +984,22 @@ async def websocket_endpoint(websocket: WebSocket, match_id: str):
     try:
         while True:
             data = await websocket.receive_text()
-            message = json.loads(data)
-            
-            if message.get("type") == "submit_answer":
-                answer_data = message.get("data", {})
-                try:
-                    await submit_answer(AnswerRequest(
-                        match_id=match_id,
-                        question_id=answer_data.get("question_id", ""),
-                        player_name=player_name,
-                        answer_payload=answer_data.get("answer", "")
-                    ))
-                except HTTPException as e:
-                    await websocket.send_text(json.dumps({
-                        "type": "error",
-                        "data": {"message": e.detail}
-                    }))
+            message = orjson.loads(data)
             
-            elif message.get("type") == "skip_round":
-                match = matches.get(match_id)
-                if match and match.current_round:
-                    cr = match.current_round
-                    if player_name not in cr.skipped_by:
-                        cr.skipped_by.append(player_name)
-                        await broadcast_to_match(match_id, {
-                            "type": "skip_update",
-                            "data": {
-                                "skipped_by": cr.skipped_by,
-                                "total": len(match.players)
-                            }
-                        })
-                    # If both players skipped, end round without damage
-                    if len(cr.skipped_by) >= len(match.players):
-                        if match_id in round_timers:
-                            round_timers[match_id].cancel()
-                        # Include solution, correct answer and citations so players can review
-                        question = cr.question
-                        saved = file_storage.get_saved_files(match.course_id)
-                        saved_map = {sf.get("file_name"): sf.get("saved_name") for sf in saved}
-                        await broadcast_to_match(match_id, {
-                            "type": "round_result",
-                            "data": {
-                                "skipped": True,
-                                "damage": 0,
-                                "solution": question.solution_steps,
-                                "correct_answer": question.correct_answer,
-                                "citation": [
-                                    {
-                                        "file_name": sc.file_name,
-                                        "page": sc.page,
-                                        "chunk_id": sc.chunk_id,
-                                        "url": f"/files/{match.course_id}/{saved_map.get(sc.file_name, '')}#page={sc.page}" if saved_map.get(sc.file_name) else None
-                                    } for sc in question.source_chunks
-                                ],
-                                "players": {name: {"hp": p.hp} for name, p in match.players.items()}
-                            }
-                        })
-                        match.current_round = None
-                        await asyncio.sleep(1)
-                        await start_new_round(match_id)
-                else:
-                    await websocket.send_text(json.dumps({
-                        "type": "error",
-                        "data": {"message": "No active round"}
-                    }))
-
-            elif message.get("type") == "ping":
-                await websocket.send_text(json.dumps({"type": "pong"}))
+            handler = WS_HANDLERS.get(message.get("type"))
+            if handler is not None:
+                await handler(match_id, player_name, message.get("data", {}))
     
     except WebSocketDisconnect:
         logger.info(f"Player {player_name} disconnected from match {match_id}")
     except Exception as e:
         logger.error(f"WebSocket error: {e}")
     finally:
-        if match_id in websocket_connections:
-            websocket_connections[match_id].pop(player_name, None)
+        writer.cancel()
+        # A reconnect may already have replaced this player's entry
+        conn = connections.get(player_name)
+        if conn is not None and conn[0] is websocket:
+            del connections[player_name]
 
 
 if os.path.exists("frontend/dist"):
@@ -830,7 +1017,12 @@ async def health_check():
     return {"status": "healthy", "version": "1.0.0"}
 @app.delete("/api/courses")
 async def delete_all_courses():
+    # A still-running index would otherwise re-register a deleted course
+    for task in list(indexing_tasks.values()):
+        await _cancel_and_wait(task)
+    await rag_pipeline.cancel_reindexing()
     deleted = file_storage.delete_all()
     rag_pipeline.indices = {}
     rag_pipeline.chunk_mappings = {}
+    course_concepts.clear()
     return {"deleted_courses": deleted}
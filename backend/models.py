@@ -1,6 +1,8 @@
+from dataclasses import dataclass, field
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 from enum import Enum
+import time
 import uuid
 
 
@@ -26,6 +28,19 @@ class SourceChunk(BaseModel):
     char_end: int
     text: Optional[str] = None
 
+    @classmethod
+    def from_chunk(cls, chunk: Dict[str, Any], text_limit: Optional[int] = None) -> "SourceChunk":
+        # Stored chunks are already well-typed, so skip field validation
+        return cls.model_construct(
+            doc_id=chunk.get("doc_id", ""),
+            file_name=chunk.get("file_name", ""),
+            page=chunk.get("page_number", chunk.get("page", 1)),
+            chunk_id=chunk.get("chunk_id", ""),
+            char_start=chunk.get("char_start", 0),
+            char_end=chunk.get("char_end", 0),
+            text=chunk.get("text", "")[:text_limit] if text_limit is not None else None
+        )
+
 
 class ChunkMetadata(BaseModel):
     doc_id: str
@@ -40,6 +55,8 @@ class UploadResponse(BaseModel):
     course_id: str
     files: List[str]
     chunks_indexed: int
+    # "indexing" while embeddings are built in the background
+    status: str = "ready"
 
 
 class CreateMatchRequest(BaseModel):
@@ -111,34 +128,71 @@ class ChatResponse(BaseModel):
     citation: Optional[List[SourceChunk]] = None
 
 
-class Player(BaseModel):
+# Live match state is mutated on every answer and timeout and never crosses
+# the API boundary, so it uses plain slotted dataclasses instead of pydantic
+@dataclass(slots=True)
+class Player:
     name: str
     hp: int = 100
     last_submission_time: Optional[float] = None
     cooldown_until: Optional[float] = None
     submitted_this_round: bool = False
+    # Set while a free-text answer is out for LLM grading
+    verifying: bool = False
 
 
-class CurrentRound(BaseModel):
+@dataclass(slots=True)
+class CurrentRound:
     question_id: str
     question: GeneratedQuestion
     start_time: float
     time_limit: int
-    answers_received: Dict[str, Any] = {}
-    skipped_by: List[str] = []
+    answers_received: Dict[str, Any] = field(default_factory=dict)
+    skipped_by: List[str] = field(default_factory=list)
+    # Built once at round start and reused by every round_result broadcast
+    citation: List[Dict[str, Any]] = field(default_factory=list)
+    # Grading context for this round's free-text answers
+    verify_chunks: List[Dict[str, Any]] = field(default_factory=list)
 
 
-class Match(BaseModel):
+@dataclass(slots=True)
+class Match:
     match_id: str
     course_id: str
-    players: Dict[str, Player] = {}
+    players: Dict[str, Player] = field(default_factory=dict)
     current_round: Optional[CurrentRound] = None
-    rounds_history: List[Dict[str, Any]] = []
+    rounds_history: List[Dict[str, Any]] = field(default_factory=list)
     time_limit_seconds: int = 30
-    question_types: List[QuestionType] = [QuestionType.SHORT]
+    question_types: List[QuestionType] = field(default_factory=lambda: [QuestionType.SHORT])
     difficulty: Difficulty = Difficulty.MEDIUM
     status: str = "waiting"
     winner: Optional[str] = None
+    # player name -> the other player's name, filled in once the match is full
+    opponent_of: Dict[str, str] = field(default_factory=dict)
+    created_at: float = field(default_factory=time.time)
+    ended_at: Optional[float] = None
+    # player name -> (websocket, outbound queue) for connected players
+    connections: Dict[str, Tuple[Any, Any]] = field(default_factory=dict, repr=False)
+    # {name: {"hp": ...}} view shared by every broadcast until HP changes
+    _hp_snapshot: Optional[Dict[str, Dict[str, int]]] = field(default=None, repr=False)
+
+    def hp_snapshot(self) -> Dict[str, Dict[str, int]]:
+        if self._hp_snapshot is None or len(self._hp_snapshot) != len(self.players):
+            self._hp_snapshot = {name: {"hp": p.hp} for name, p in self.players.items()}
+        return self._hp_snapshot
+
+    def apply_damage(self, player_name: str, damage: int):
+        player = self.players[player_name]
+        player.hp = max(0, player.hp - damage)
+        self._hp_snapshot = None
+
+
+@dataclass(slots=True)
+class AnswerOutcome:
+    response: Optional[AnswerResponse] = None
+    # Rejection reason and the HTTP status it maps to
+    error: Optional[str] = None
+    status_code: int = 400
 
 
 class WebSocketMessage(BaseModel):
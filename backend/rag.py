@@ -1,20 +1,85 @@
 import os
-from typing import List, Dict, Optional
+import re
+import time
+import asyncio
+import threading
+import math
+import heapq
+import sqlite3
+import hashlib
+from array import array
+from collections import Counter, OrderedDict
+from itertools import islice
+from typing import List, Dict, Optional, Set, Tuple
 from llama_index.core import Document, VectorStoreIndex, StorageContext, Settings
 from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.ingestion import run_transformations
+from llama_index.core.schema import BaseNode, MetadataMode
 from llama_index.vector_stores.milvus import MilvusVectorStore
 from llama_index.embeddings.openai import OpenAIEmbedding
+from pymilvus import MilvusClient
 import logging
 
 logger = logging.getLogger(__name__)
 
+_TOKEN_SPLIT_RE = re.compile(r"\W+")
+# Okapi BM25 term-frequency saturation and length normalization
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Chunks per embeddings request; the library default of 10 means one HTTP
+# round trip for every ten chunks while indexing
+EMBED_BATCH_SIZE = 256
+# Embedding requests in flight at once while indexing a course
+EMBED_CONCURRENCY = 4
+# text-embedding-3-small is trained to be truncated; 512 of its 1536 dimensions
+# keep most of the retrieval quality at a third of the bytes per vector
+EMBEDDING_DIMENSIONS = int(os.environ.get("EMBEDDING_DIMENSIONS", "512"))
+# Full size of text-embedding-3-small, used by collections indexed before
+# EMBEDDING_DIMENSIONS existed
+LEGACY_EMBEDDING_DIM = 1536
+# Rows per Milvus insert call; the store's default of 100 turns a large course
+# into dozens of small writes
+MILVUS_INSERT_BATCH_SIZE = 1000
+# Embedding-search results kept per (course, normalized query, top_k)
+RETRIEVAL_CACHE_SIZE = 512
+# A course that failed to index is retried in the background after this
+# many seconds, doubling per consecutive failure up to the cap
+REINDEX_BACKOFF_BASE = 60
+REINDEX_BACKOFF_MAX = 3600
+# Vectors keyed by content hash, so re-uploading a file doesn't re-embed it
+EMBED_CACHE_PATH = os.path.join(os.path.dirname(__file__), "data", "embedding_cache.db")
+# Least recently used vectors beyond this many rows are pruned after each write
+EMBED_CACHE_MAX_ROWS = 50000
+# Per-upload ids and offsets; kept out of the embedded text so identical
+# content embeds (and caches) identically across uploads
+_VOLATILE_METADATA_KEYS = ["doc_id", "chunk_id", "char_start", "char_end"]
+
 
 class RAGPipeline:
     
     def __init__(self):
         self.indices: Dict[str, VectorStoreIndex] = {}
         self.chunk_mappings: Dict[str, Dict[str, Dict]] = {}
+        # course_id -> (mapping it was built from, its size, chunk list)
+        self._all_chunks_cache: Dict[str, Tuple[Dict[str, Dict], int, List[Dict]]] = {}
+        # course_id -> (mapping it was built from, its size, chunk list,
+        # token -> (idf, [(position in chunk list, term frequency)]),
+        # BM25 length normalization per chunk)
+        self._keyword_index: Dict[str, Tuple[Dict[str, Dict], int, List[Dict], Dict[str, Tuple[float, List[Tuple[int, int]]]], List[float]]] = {}
+        # (course_id, normalized query, top_k) -> (index searched, results)
+        self._retrieval_cache: "OrderedDict[Tuple[str, str, int], Tuple[VectorStoreIndex, List[Dict]]]" = OrderedDict()
         self._embedding_model = None
+        self._legacy_embedding_model = None
+        self._milvus_client: Optional[MilvusClient] = None
+        # Courses with an index_chunks run in progress, and the tasks that
+        # rebuild courses whose collection is missing
+        self._indexing: Set[str] = set()
+        self._reindex_tasks: Set[asyncio.Task] = set()
+        # course_id -> (consecutive failed index runs, time of next retry)
+        self._index_failures: Dict[str, Tuple[int, float]] = {}
+        self._embed_cache: Optional[sqlite3.Connection] = None
+        # The cache is used from worker threads, one indexing run at a time
+        self._embed_cache_lock = threading.Lock()
         self._embedding_dim = 1536
         self._use_rag = False
         self._initialize_embeddings()
@@ -25,10 +90,13 @@ class RAGPipeline:
             try:
                 self._embedding_model = OpenAIEmbedding(
                     api_key=openai_key,
-                    model="text-embedding-3-small"
+                    model="text-embedding-3-small",
+                    dimensions=EMBEDDING_DIMENSIONS,
+                    embed_batch_size=EMBED_BATCH_SIZE,
+                    num_workers=EMBED_CONCURRENCY
                 )
                 Settings.embed_model = self._embedding_model
-                self._embedding_dim = 1536
+                self._embedding_dim = EMBEDDING_DIMENSIONS
                 self._use_rag = True
                 logger.info("Using OpenAI embeddings - RAG enabled")
                 return
@@ -38,7 +106,8 @@ class RAGPipeline:
         logger.info("No OpenAI API key - using direct chunk retrieval instead of RAG")
         self._use_rag = False
     
-    def _get_vector_store(self, collection_name: str) -> Optional[MilvusVectorStore]:
+    def _get_vector_store(self, collection_name: str, dim: Optional[int] = None) -> Optional[MilvusVectorStore]:
+        dim = dim or self._embedding_dim
         zilliz_uri = os.environ.get("ZILLIZ_URI") or os.environ.get("Public_Endpoint")
         zilliz_token = os.environ.get("ZILLIZ_TOKEN") or os.environ.get("zilliz_token")
         
@@ -48,8 +117,9 @@ class RAGPipeline:
                     uri=zilliz_uri,
                     token=zilliz_token,
                     collection_name=collection_name,
-                    dim=self._embedding_dim,
-                    overwrite=False
+                    dim=dim,
+                    overwrite=False,
+                    batch_size=MILVUS_INSERT_BATCH_SIZE
                 )
                 logger.info(f"Connected to Zilliz Cloud: {collection_name}")
                 return vector_store
@@ -60,8 +130,9 @@ class RAGPipeline:
             vector_store = MilvusVectorStore(
                 uri="./milvus_data.db",
                 collection_name=collection_name,
-                dim=self._embedding_dim,
-                overwrite=False
+                dim=dim,
+                overwrite=False,
+                batch_size=MILVUS_INSERT_BATCH_SIZE
             )
             logger.info(f"Using local Milvus Lite: {collection_name}")
             return vector_store
@@ -69,16 +140,81 @@ class RAGPipeline:
             logger.warning(f"Failed to create local Milvus: {e}")
             return None
 
+    def _collection_name(self, course_id: str, dim: Optional[int] = None) -> str:
+        # Collections are fixed to one vector size, so non-default sizes get
+        # their own name instead of colliding with 1536-dim collections
+        dim = dim or self._embedding_dim
+        if dim == LEGACY_EMBEDDING_DIM:
+            return f"study_battle_{course_id[:8]}"
+        return f"study_battle_{course_id[:8]}_d{dim}"
+
+    def _get_milvus_client(self) -> Optional[MilvusClient]:
+        # Same target as _get_vector_store, used to look collections up
+        # without creating them
+        if self._milvus_client is None:
+            zilliz_uri = os.environ.get("ZILLIZ_URI") or os.environ.get("Public_Endpoint")
+            zilliz_token = os.environ.get("ZILLIZ_TOKEN") or os.environ.get("zilliz_token")
+            if zilliz_uri and zilliz_token:
+                try:
+                    self._milvus_client = MilvusClient(uri=zilliz_uri, token=zilliz_token)
+                except Exception as e:
+                    logger.warning(f"Failed to connect to Zilliz: {e}")
+            if self._milvus_client is None:
+                try:
+                    self._milvus_client = MilvusClient(uri="./milvus_data.db")
+                except Exception as e:
+                    logger.warning(f"Failed to open local Milvus: {e}")
+        return self._milvus_client
+
+    def _collection_has_rows(self, collection_name: str) -> bool:
+        client = self._get_milvus_client()
+        if client is None:
+            return False
+        try:
+            if not client.has_collection(collection_name):
+                return False
+            return int(client.get_collection_stats(collection_name).get("row_count", 0)) > 0
+        except Exception as e:
+            logger.warning(f"Failed to inspect collection {collection_name}: {e}")
+            return False
+
+    def _get_legacy_embedding_model(self) -> OpenAIEmbedding:
+        if self._legacy_embedding_model is None:
+            self._legacy_embedding_model = OpenAIEmbedding(
+                api_key=os.environ.get("OPENAI_API_KEY"),
+                model="text-embedding-3-small",
+                embed_batch_size=EMBED_BATCH_SIZE,
+                num_workers=EMBED_CONCURRENCY
+            )
+        return self._legacy_embedding_model
+
     def _ensure_index(self, course_id: str) -> Optional[VectorStoreIndex]:
         if course_id in self.indices:
             return self.indices[course_id]
-        collection_name = f"study_battle_{course_id[:8]}"
-        vector_store = self._get_vector_store(collection_name)
+        # Only an existing, populated collection is opened: opening a missing
+        # one would create it empty and cache an index that finds nothing
+        collection_name = self._collection_name(course_id)
+        dim = self._embedding_dim
+        embed_model = self._embedding_model
+        if not self._collection_has_rows(collection_name):
+            legacy_name = self._collection_name(course_id, LEGACY_EMBEDDING_DIM)
+            if legacy_name == collection_name or not self._collection_has_rows(legacy_name):
+                return None
+            # Courses indexed at full size before EMBEDDING_DIMENSIONS keep
+            # their collection; their queries are embedded at that size too
+            collection_name = legacy_name
+            dim = LEGACY_EMBEDDING_DIM
+            embed_model = self._get_legacy_embedding_model()
+        vector_store = self._get_vector_store(collection_name, dim)
         if not vector_store:
             return None
         try:
             storage_context = StorageContext.from_defaults(vector_store=vector_store)
-            index = VectorStoreIndex.from_vector_store(vector_store=vector_store, storage_context=storage_context)
+            index = VectorStoreIndex.from_vector_store(
+                vector_store=vector_store,
+                storage_context=storage_context,
+                embed_model=embed_model
+            )
             self.indices[course_id] = index
             logger.info(f"Reused persistent index for course {course_id}")
             return index
@@ -86,12 +222,58 @@ class RAGPipeline:
             logger.warning(f"Failed to reuse index for course {course_id}: {e}")
             return None
     
+    def _schedule_reindex(self, course_id: str):
+        # A course whose collection is missing is rebuilt from its registered
+        # chunks in the background
+        mapping = self.chunk_mappings.get(course_id)
+        if not mapping or course_id in self._indexing:
+            return
+        failure = self._index_failures.get(course_id)
+        if failure is not None and time.time() < failure[1]:
+            return
+        task = asyncio.create_task(self.index_chunks(course_id, list(mapping.values())))
+        self._reindex_tasks.add(task)
+        task.add_done_callback(self._reindex_tasks.discard)
+    
+    async def cancel_reindexing(self):
+        # Called before courses are deleted and at shutdown, so no rebuild
+        # re-registers a course that is gone
+        tasks = list(self._reindex_tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._index_failures.clear()
+    
+    def register_chunks(self, course_id: str, chunks: List[Dict]):
+        # Makes a course's chunks available to rounds and keyword retrieval
+        # right away, ahead of (or without) embedding. Storage chunks already
+        # have exactly the mapping's fields, so the same dicts are shared
+        # rather than keeping a second copy per chunk
+        self.chunk_mappings[course_id] = {chunk["chunk_id"]: chunk for chunk in chunks}
+    
     async def index_chunks(self, course_id: str, chunks: List[Dict]) -> int:
         if not chunks:
             return 0
         
+        self._indexing.add(course_id)
+        count = 0
+        try:
+            count = await self._index_chunks(course_id, chunks)
+            return count
+        finally:
+            self._indexing.discard(course_id)
+            if count:
+                self._index_failures.pop(course_id, None)
+            elif not asyncio.current_task().cancelling():
+                # Backs off retries, rather than re-embedding the course on
+                # every retrieve while the failure persists
+                failures = self._index_failures.get(course_id, (0, 0.0))[0] + 1
+                delay = min(REINDEX_BACKOFF_BASE * 2 ** (failures - 1), REINDEX_BACKOFF_MAX)
+                self._index_failures[course_id] = (failures, time.time() + delay)
+    
+    async def _index_chunks(self, course_id: str, chunks: List[Dict]) -> int:
         documents = []
-        self.chunk_mappings[course_id] = {}
+        self.register_chunks(course_id, chunks)
         
         for chunk in chunks:
             metadata = {
@@ -106,26 +288,22 @@ class RAGPipeline:
             doc = Document(
                 text=chunk["text"],
                 metadata=metadata,
-                id_=chunk["chunk_id"]
+                id_=chunk["chunk_id"],
+                excluded_embed_metadata_keys=_VOLATILE_METADATA_KEYS
             )
             documents.append(doc)
-            
-            self.chunk_mappings[course_id][chunk["chunk_id"]] = {
-                **metadata,
-                "text": chunk["text"]
-            }
         
-        collection_name = f"study_battle_{course_id[:8]}"
-        vector_store = self._get_vector_store(collection_name)
+        nodes = await self._embed_documents(documents)
+        
+        # Connecting, inserting and any fallback embedding block, so they run
+        # in a thread and other requests keep being served meanwhile
+        collection_name = self._collection_name(course_id)
+        vector_store = await asyncio.to_thread(self._get_vector_store, collection_name)
         
         if vector_store:
             try:
                 storage_context = StorageContext.from_defaults(vector_store=vector_store)
-                index = VectorStoreIndex.from_documents(
-                    documents,
-                    storage_context=storage_context,
-                    show_progress=True
-                )
+                index = await asyncio.to_thread(self._build_index, documents, nodes, storage_context)
                 self.indices[course_id] = index
                 logger.info(f"Indexed {len(documents)} chunks for course {course_id}")
                 return len(documents)
@@ -133,10 +311,7 @@ class RAGPipeline:
                 logger.error(f"Failed to index with vector store: {e}")
         
         try:
-            index = VectorStoreIndex.from_documents(
-                documents,
-                show_progress=True
-            )
+            index = await asyncio.to_thread(self._build_index, documents, nodes)
             self.indices[course_id] = index
             logger.info(f"Indexed {len(documents)} chunks in memory for course {course_id}")
             return len(documents)
@@ -144,49 +319,151 @@ class RAGPipeline:
             logger.error(f"Failed to create index: {e}")
             return 0
     
+    async def _embed_documents(self, documents: List[Document]) -> Optional[List[BaseNode]]:
+        # Embeds on the event loop with EMBED_CONCURRENCY batch requests in
+        # flight, instead of the one-batch-at-a-time blocking calls made inside
+        # from_documents; the index build then only has to store the vectors
+        if self._embedding_model is None:
+            return None
+        try:
+            nodes = await asyncio.to_thread(run_transformations, documents, Settings.transformations)
+            texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+            keys = [self._embed_cache_key(text) for text in texts]
+            cached = await asyncio.to_thread(self._embed_cache_get_many, keys)
+            # Repeated boilerplate (headers, footers) is embedded once per
+            # distinct text, and only when it isn't cached already
+            pending: Dict[bytes, str] = {}
+            for text, key in zip(texts, keys):
+                if key not in cached and key not in pending:
+                    pending[key] = text
+            vectors = await self._embedding_model.aget_text_embedding_batch(list(pending.values()))
+            fresh = dict(zip(pending, vectors))
+            for node, key in zip(nodes, keys):
+                node.embedding = cached[key] if key in cached else fresh[key]
+            await asyncio.to_thread(self._embed_cache_put_many, list(fresh.items()))
+            if len(fresh) < len(nodes):
+                logger.info(f"Embedded {len(fresh)} of {len(nodes)} chunks; the rest were cached or duplicates")
+            return nodes
+        except Exception as e:
+            logger.warning(f"Concurrent embedding failed, embedding during indexing instead: {e}")
+            return None
+    
+    def _get_embed_cache(self) -> Optional[sqlite3.Connection]:
+        if self._embed_cache is None:
+            try:
+                os.makedirs(os.path.dirname(EMBED_CACHE_PATH), exist_ok=True)
+                conn = sqlite3.connect(EMBED_CACHE_PATH, check_same_thread=False)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                conn.execute("CREATE TABLE IF NOT EXISTS e(k BLOB PRIMARY KEY, v BLOB, ts REAL)")
+                # Caches from before eviction have no last-used column
+                if "ts" not in [row[1] for row in conn.execute("PRAGMA table_info(e)")]:
+                    conn.execute("ALTER TABLE e ADD COLUMN ts REAL DEFAULT 0")
+                conn.execute("CREATE INDEX IF NOT EXISTS e_ts ON e(ts)")
+                conn.commit()
+                self._embed_cache = conn
+            except sqlite3.Error as e:
+                logger.warning(f"Embedding cache unavailable: {e}")
+                return None
+        return self._embed_cache
+    
+    def _embed_cache_key(self, text: str) -> bytes:
+        h = hashlib.blake2b(digest_size=16)
+        h.update(f"{self._embedding_model.model_name}:{self._embedding_dim}".encode())
+        h.update(b"\0")
+        h.update(text.encode())
+        return h.digest()
+    
+    def _embed_cache_get_many(self, keys: List[bytes]) -> Dict[bytes, List[float]]:
+        # Blocking; called through asyncio.to_thread
+        with self._embed_cache_lock:
+            conn = self._get_embed_cache()
+            if conn is None:
+                return {}
+            found: Dict[bytes, List[float]] = {}
+            try:
+                # Batched to stay under SQLite's bound-parameter limit
+                for start in range(0, len(keys), 500):
+                    batch = keys[start:start + 500]
+                    placeholders = ",".join("?" * len(batch))
+                    rows = conn.execute(f"SELECT k, v FROM e WHERE k IN ({placeholders})", batch)
+                    for k, v in rows:
+                        found[k] = array("d", v).tolist()
+                    # Hits count as uses, so eviction drops the least recently used
+                    conn.execute(f"UPDATE e SET ts = ? WHERE k IN ({placeholders})", [time.time(), *batch])
+                conn.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Embedding cache read failed: {e}")
+                return {}
+            return found
+    
+    def _embed_cache_put_many(self, items: List[Tuple[bytes, List[float]]]):
+        # Blocking; called through asyncio.to_thread
+        with self._embed_cache_lock:
+            conn = self._get_embed_cache()
+            if conn is None or not items:
+                return
+            try:
+                now = time.time()
+                conn.executemany(
+                    "INSERT OR REPLACE INTO e(k, v, ts) VALUES (?, ?, ?)",
+                    [(k, array("d", v).tobytes(), now) for k, v in items]
+                )
+                conn.execute(
+                    "DELETE FROM e WHERE k IN (SELECT k FROM e ORDER BY ts DESC LIMIT -1 OFFSET ?)",
+                    (EMBED_CACHE_MAX_ROWS,)
+                )
+                conn.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Embedding cache write failed: {e}")
+    
+    def _build_index(
+        self,
+        documents: List[Document],
+        nodes: Optional[List[BaseNode]],
+        storage_context: Optional[StorageContext] = None
+    ) -> VectorStoreIndex:
+        if nodes is None:
+            return VectorStoreIndex.from_documents(
+                documents,
+                storage_context=storage_context,
+                show_progress=True
+            )
+        return VectorStoreIndex(
+            nodes=nodes,
+            storage_context=storage_context,
+            show_progress=True
+        )
+    
     async def retrieve(
         self, 
         course_id: str, 
         query: str, 
         top_k: int = 5
     ) -> List[Dict]:
-        if not self._use_rag:
-            if course_id in self.chunk_mappings:
-                chunks = list(self.chunk_mappings[course_id].values())
-                q = (query or "").lower()
-                if q:
-                    import re
-                    tokens = [t for t in re.split(r"\W+", q) if t]
-                    token_set = set(tokens)
-                    scored = []
-                    for ch in chunks:
-                        text = (ch.get("text") or "").lower()
-                        if not text:
-                            continue
-                        score = sum(text.count(tok) for tok in token_set)
-                        if len(tokens) >= 2 and " ".join(tokens) in text:
-                            score += 2
-                        scored.append((score, ch))
-                    scored.sort(key=lambda x: x[0], reverse=True)
-                    nonzero = [ch for s, ch in scored if s > 0]
-                    if nonzero:
-                        return nonzero[:top_k]
-                return chunks[:top_k]
-            logger.warning(f"No chunks for course {course_id}")
-            return []
+        # Keyword search also covers a course while its vectors are being
+        # written, rather than searching a half-filled collection
+        if not self._use_rag or course_id in self._indexing:
+            return self._keyword_retrieve(course_id, query, top_k)
         if course_id not in self.indices:
-            index_reused = self._ensure_index(course_id)
-            if not index_reused:
+            if not await asyncio.to_thread(self._ensure_index, course_id):
+                # Keyword search covers the course until its vectors exist
                 logger.warning(f"No index found for course {course_id}")
-                if course_id in self.chunk_mappings:
-                    chunks = list(self.chunk_mappings[course_id].values())[:top_k]
-                    return chunks
-                return []
+                self._schedule_reindex(course_id)
+                return self._keyword_retrieve(course_id, query, top_k)
+        
+        index = self.indices[course_id]
+        # A repeated question skips the query embedding and vector search;
+        # re-indexing installs a new index, which invalidates the entry
+        cache_key = (course_id, " ".join((query or "").lower().split()), top_k)
+        cached = self._retrieval_cache.get(cache_key)
+        if cached is not None and cached[0] is index:
+            self._retrieval_cache.move_to_end(cache_key)
+            return list(cached[1])
         
         try:
-            index = self.indices[course_id]
             retriever = index.as_retriever(similarity_top_k=top_k)
-            nodes = retriever.retrieve(query)
+            nodes = await asyncio.to_thread(retriever.retrieve, query)
             
             results = []
             for node in nodes:
@@ -197,23 +474,98 @@ class RAGPipeline:
                 }
                 results.append(chunk_data)
             
-            return results
+            self._retrieval_cache[cache_key] = (index, results)
+            if len(self._retrieval_cache) > RETRIEVAL_CACHE_SIZE:
+                self._retrieval_cache.popitem(last=False)
+            return list(results)
         except Exception as e:
             logger.error(f"Retrieval error: {e}")
             if course_id in self.chunk_mappings:
-                chunks = list(self.chunk_mappings[course_id].values())[:top_k]
-                return chunks
+                return list(islice(self.chunk_mappings[course_id].values(), top_k))
             return []
     
+    def _keyword_retrieve(self, course_id: str, query: str, top_k: int) -> List[Dict]:
+        if course_id in self.chunk_mappings:
+            chunks, postings, norms = self._get_keyword_index(course_id)
+            q = (query or "").lower()
+            if q:
+                tokens = [t for t in _TOKEN_SPLIT_RE.split(q) if t]
+                # BM25 over the postings: rare terms weigh more and long
+                # chunks don't win just by repeating common words
+                scores: Dict[int, float] = {}
+                for tok in set(tokens):
+                    entry = postings.get(tok)
+                    if entry is None:
+                        continue
+                    idf, plist = entry
+                    for pos, tf in plist:
+                        scores[pos] = scores.get(pos, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norms[pos])
+                if scores:
+                    if len(tokens) >= 2:
+                        # The phrase bonus can only lift chunks already
+                        # within reach of the top_k, so only those are scanned
+                        phrase = " ".join(tokens)
+                        cutoff = 0
+                        if len(scores) > top_k:
+                            cutoff = heapq.nlargest(top_k, scores.values())[-1] - 2
+                        for pos, score in scores.items():
+                            if score >= cutoff and phrase in chunks[pos]["text"].lower():
+                                scores[pos] = score + 2
+                    best = heapq.nlargest(top_k, scores, key=lambda pos: (scores[pos], -pos))
+                    return [chunks[pos] for pos in best]
+            return chunks[:top_k]
+        logger.warning(f"No chunks for course {course_id}")
+        return []
+    
+    def _get_keyword_index(self, course_id: str) -> Tuple[List[Dict], Dict[str, Tuple[float, List[Tuple[int, int]]]], List[float]]:
+        # Chunk texts are tokenized once per mapping, with each term's idf and
+        # each chunk's length factor precomputed; queries then only walk the
+        # postings of their own tokens instead of rescanning every chunk
+        mapping = self.chunk_mappings.get(course_id) or {}
+        entry = self._keyword_index.get(course_id)
+        if entry is not None and entry[0] is mapping and entry[1] == len(mapping):
+            return entry[2], entry[3], entry[4]
+        chunks = self.get_all_chunks(course_id)
+        plists: Dict[str, List[Tuple[int, int]]] = {}
+        doc_lens = [0] * len(chunks)
+        for pos, ch in enumerate(chunks):
+            text = (ch.get("text") or "").lower()
+            if not text:
+                continue
+            counts = Counter(t for t in _TOKEN_SPLIT_RE.split(text) if t)
+            doc_lens[pos] = sum(counts.values())
+            for tok, tf in counts.items():
+                plists.setdefault(tok, []).append((pos, tf))
+        n_docs = sum(1 for n in doc_lens if n)
+        avg_len = sum(doc_lens) / n_docs if n_docs else 1.0
+        norms = [BM25_K1 * (1 - BM25_B + BM25_B * n / avg_len) for n in doc_lens]
+        postings = {
+            tok: (math.log((n_docs - len(plist) + 0.5) / (len(plist) + 0.5) + 1.0), plist)
+            for tok, plist in plists.items()
+        }
+        self._keyword_index[course_id] = (mapping, len(mapping), chunks, postings, norms)
+        return chunks, postings, norms
+    
     def get_chunk_by_id(self, course_id: str, chunk_id: str) -> Optional[Dict]:
         if course_id in self.chunk_mappings:
             return self.chunk_mappings[course_id].get(chunk_id)
         return None
     
     def get_all_chunks(self, course_id: str) -> List[Dict]:
-        if course_id in self.chunk_mappings:
-            return list(self.chunk_mappings[course_id].values())
-        return []
+        # Every round and answer asks for the full list, so it is materialized
+        # once per mapping; re-indexing installs a new mapping and a reset of
+        # chunk_mappings drops it, either of which invalidates the entry.
+        # Callers must treat the returned list as read-only.
+        mapping = self.chunk_mappings.get(course_id)
+        if mapping is None:
+            self._all_chunks_cache.pop(course_id, None)
+            return []
+        entry = self._all_chunks_cache.get(course_id)
+        if entry is not None and entry[0] is mapping and entry[1] == len(mapping):
+            return entry[2]
+        chunks = list(mapping.values())
+        self._all_chunks_cache[course_id] = (mapping, len(mapping), chunks)
+        return chunks
 
 
 rag_pipeline = RAGPipeline()
@@ -1,14 +1,26 @@
 import os
 import uuid
-import json
+import orjson
+import shutil
+import itertools
 import tempfile
-from typing import List, Dict, Tuple, Optional
+from typing import List, Dict, Tuple, Optional, BinaryIO, Iterator
 import pdfplumber
+# PyMuPDF extracts plain text an order of magnitude faster than pdfplumber;
+# pdfplumber stays as the fallback where it isn't installed
+try:
+    import fitz
+except ImportError:
+    fitz = None
 from docx import Document as DocxDocument
 from pptx import Presentation
 from PIL import Image
 import io
-import re
+import asyncio
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 
 PERSIST_BASE = os.path.join(os.path.dirname(__file__), "data")
@@ -16,22 +28,58 @@ PERSIST_UPLOADS = os.path.join(PERSIST_BASE, "uploads")
 PERSIST_COURSES = os.path.join(PERSIST_BASE, "courses")
 UPLOAD_DIR = PERSIST_UPLOADS
 MAX_FILE_SIZE = 20 * 1024 * 1024
+COPY_BUFFER_SIZE = 64 * 1024
+# Extraction is CPU-bound, so files in an upload are parsed in parallel.
+# Each worker holds one file at a time, which bounds memory to roughly
+# EXTRACT_WORKERS * MAX_FILE_SIZE of parsing state
+EXTRACT_WORKERS = os.cpu_count() or 1
+# A large PDF is split into page ranges of at least this many pages, one
+# per worker; below that, process start-up outweighs the parallel win
+PDF_PAGES_PER_WORKER = 32
+# A course's chunks live next to its manifest, in <course_id> + this suffix
+CHUNKS_SUFFIX = ".chunks.json"
+# Order of the per-chunk values in a manifest chunk row, after the
+# file_name and doc_id table indexes
+MANIFEST_CHUNK_FIELDS = ("page_number", "chunk_id", "char_start", "char_end", "text")
 
 
 class TextExtractor:
     
     @staticmethod
-    def extract_from_pdf(file_path: str) -> List[Dict]:
+    def _pdf_page_texts(file_path: str, page_range: Optional[Tuple[int, int]] = None):
+        start, stop = page_range or (0, None)
+        if fitz is not None:
+            doc = fitz.open(file_path)
+            try:
+                for i in range(start, doc.page_count if stop is None else stop):
+                    page = doc[i]
+                    # Text is only drawn inside BT/ET blocks, either in the page's
+                    # own content stream or in a form XObject it paints; a scanned
+                    # page has neither, so skip the full text pass over its images
+                    if b"BT" not in page.read_contents() and not page.get_xobjects():
+                        yield ""
+                        continue
+                    yield page.get_text("text")
+            finally:
+                doc.close()
+        else:
+            with pdfplumber.open(file_path) as pdf:
+                for page in pdf.pages[start:stop]:
+                    yield page.extract_text() or ""
+    
+    @staticmethod
+    def extract_from_pdf(file_path: str, page_range: Optional[Tuple[int, int]] = None) -> List[Dict]:
         pages = []
+        first_page = page_range[0] if page_range else 0
         try:
-            with pdfplumber.open(file_path) as pdf:
-                for i, page in enumerate(pdf.pages):
-                    text = page.extract_text() or ""
-                    pages.append({
-                        "page_number": i + 1,
-                        "text": text,
-                        "char_start": sum(len(p["text"]) for p in pages),
-                    })
+            char_offset = 0
+            for i, text in enumerate(TextExtractor._pdf_page_texts(file_path, page_range)):
+                pages.append({
+                    "page_number": first_page + i + 1,
+                    "text": text,
+                    "char_start": char_offset,
+                })
+                char_offset += len(text)
         except Exception as e:
             print(f"Error extracting PDF: {e}")
         return pages
@@ -99,11 +147,16 @@ class TextExtractor:
         }]
     
     @classmethod
-    def extract(cls, file_path: str, file_name: str) -> List[Dict]:
+    def extract(
+        cls,
+        file_path: str,
+        file_name: str,
+        page_range: Optional[Tuple[int, int]] = None
+    ) -> List[Dict]:
         ext = os.path.splitext(file_name)[1].lower()
         
         if ext == ".pdf":
-            return cls.extract_from_pdf(file_path)
+            return cls.extract_from_pdf(file_path, page_range)
         elif ext == ".docx":
             return cls.extract_from_docx(file_path)
         elif ext == ".pptx":
@@ -121,6 +174,9 @@ class TextChunker:
     def __init__(self, chunk_size: int = 500, overlap: int = 50):
         self.chunk_size = chunk_size
         self.overlap = overlap
+        # Chunk ids are "<doc_id>-<n>": doc_id is already a uuid4, so a counter
+        # keeps them unique without drawing fresh randomness per chunk
+        self._counter = itertools.count()
     
     def _estimate_tokens(self, text: str) -> int:
         return len(text) // 4
@@ -133,132 +189,360 @@ class TextChunker:
         page_number: int,
         base_char_offset: int = 0
     ) -> List[Dict]:
-        chunks = []
-        
-        text = re.sub(r'\s+', ' ', text).strip()
+        return list(self.iter_chunks(text, doc_id, file_name, page_number, base_char_offset))
+    
+    def iter_chunks(
+        self, 
+        text: str, 
+        doc_id: str, 
+        file_name: str, 
+        page_number: int,
+        base_char_offset: int = 0
+    ) -> Iterator[Dict]:
+        # Splitting on runs of whitespace is the same normalisation as
+        # collapsing them to single spaces, without a regex pass
+        words = text.split()
         
-        if not text:
-            return chunks
+        if not words:
+            return
         
-        words = text.split(' ')
-        current_chunk = []
+        current_chunk = deque()
+        # Length of ' '.join(current_chunk), kept incrementally so the chunk
+        # is only joined once it is emitted
+        current_len = -1
         current_char_start = base_char_offset
         char_position = base_char_offset
+        # Token budgets as character counts (4 chars per token, as in
+        # _estimate_tokens), hoisted out of the per-word loop with the append
+        chunk_chars = self.chunk_size * 4
+        overlap_chars = self.overlap * 4
+        add_word = current_chunk.append
         
         for word in words:
-            current_chunk.append(word)
+            add_word(word)
+            current_len += len(word) + 1
             
-            chunk_text = ' '.join(current_chunk)
-            if self._estimate_tokens(chunk_text) >= self.chunk_size:
-                chunk_id = str(uuid.uuid4())
+            if current_len >= chunk_chars:
                 chunk_end = char_position + len(word)
                 
-                chunks.append({
+                yield {
                     "doc_id": doc_id,
                     "file_name": file_name,
                     "page_number": page_number,
-                    "chunk_id": chunk_id,
+                    "chunk_id": f"{doc_id}-{next(self._counter)}",
                     "char_start": current_char_start,
                     "char_end": chunk_end,
-                    "text": chunk_text,
-                })
+                    "text": ' '.join(current_chunk),
+                }
                 
-                overlap_words = int(len(current_chunk) * (self.overlap / self.chunk_size))
-                if overlap_words > 0:
-                    current_chunk = current_chunk[-overlap_words:]
-                    overlap_text = ' '.join(current_chunk)
-                    current_char_start = chunk_end - len(overlap_text)
+                # Drop words off the front until the kept tail fits the overlap,
+                # so consecutive chunks advance by a fixed stride of about
+                # chunk_size - overlap tokens
+                while current_chunk and current_len > overlap_chars:
+                    current_len -= len(current_chunk.popleft()) + 1
+                if current_chunk:
+                    current_char_start = chunk_end - current_len
                 else:
-                    current_chunk = []
                     current_char_start = chunk_end + 1
             
             char_position += len(word) + 1
         
         if current_chunk:
-            chunk_id = str(uuid.uuid4())
-            chunk_text = ' '.join(current_chunk)
-            chunks.append({
+            yield {
                 "doc_id": doc_id,
                 "file_name": file_name,
                 "page_number": page_number,
-                "chunk_id": chunk_id,
+                "chunk_id": f"{doc_id}-{next(self._counter)}",
                 "char_start": current_char_start,
                 "char_end": char_position,
-                "text": chunk_text,
-            })
-        
+                "text": ' '.join(current_chunk),
+            }
+
+
+def _build_file_index(chunks: List[Dict]) -> Dict[str, List[int]]:
+    # file_name -> positions of that file's chunks in the course chunk list
+    file_index: Dict[str, List[int]] = {}
+    for i, chunk in enumerate(chunks):
+        file_index.setdefault(chunk.get("file_name"), []).append(i)
+    return file_index
+
+
+def _share_chunk_strings(chunks: List[Dict]):
+    # A parsed manifest holds a separate copy of doc_id and file_name in every
+    # chunk; point them all at one string per distinct value, as freshly
+    # chunked uploads already do
+    seen: Dict[str, str] = {}
+    for chunk in chunks:
+        for key in ("doc_id", "file_name"):
+            value = chunk.get(key)
+            if value is not None:
+                chunk[key] = seen.setdefault(value, value)
+
+
+def _encode_chunks(chunks: List[Dict]) -> Dict:
+    # Chunks are written as rows that reference file_name and doc_id by
+    # index into small tables, rather than repeating both in every chunk
+    file_names: Dict[str, int] = {}
+    doc_ids: Dict[str, int] = {}
+    rows = []
+    for chunk in chunks:
+        rows.append([
+            file_names.setdefault(chunk.get("file_name"), len(file_names)),
+            doc_ids.setdefault(chunk.get("doc_id"), len(doc_ids)),
+            *(chunk.get(key) for key in MANIFEST_CHUNK_FIELDS),
+        ])
+    return {
+        "file_names": list(file_names),
+        "doc_ids": list(doc_ids),
+        "chunks": rows,
+    }
+
+
+def _decode_manifest_chunks(manifest: Dict) -> List[Dict]:
+    chunks = manifest.get("chunks", [])
+    if "file_names" not in manifest:
+        # Manifests written before chunk rows hold one dict per chunk
+        _share_chunk_strings(chunks)
         return chunks
+    file_names = manifest["file_names"]
+    doc_ids = manifest["doc_ids"]
+    decoded = []
+    for file_idx, doc_idx, *values in chunks:
+        chunk = {"doc_id": doc_ids[doc_idx], "file_name": file_names[file_idx]}
+        chunk.update(zip(MANIFEST_CHUNK_FIELDS, values))
+        decoded.append(chunk)
+    return decoded
+
+
+def _copy_upload(file_obj: BinaryIO, path: str):
+    with open(path, "wb") as f:
+        shutil.copyfileobj(file_obj, f, COPY_BUFFER_SIZE)
+
+
+def _pdf_page_ranges(file_path: str) -> List[Optional[Tuple[int, int]]]:
+    # Only PyMuPDF can cheaply reopen a document per worker for a page range
+    if fitz is None:
+        return [None]
+    try:
+        with fitz.open(file_path) as doc:
+            page_count = doc.page_count
+    except Exception:
+        return [None]
+    parts = min(EXTRACT_WORKERS, page_count // PDF_PAGES_PER_WORKER)
+    if parts <= 1:
+        return [None]
+    step = -(-page_count // parts)
+    return [(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+
+
+def _extract_and_chunk(
+    file_path: str,
+    file_name: str,
+    doc_id: str,
+    chunk_size: int,
+    overlap: int,
+    page_range: Optional[Tuple[int, int]] = None
+) -> Tuple[List[Dict], int]:
+    # Runs in a worker process; also returns the extracted text length so
+    # page ranges can be stitched back together
+    chunker = TextChunker(chunk_size, overlap)
+    chunks = []
+    add_chunks = chunks.extend
+    text_len = 0
+    for page in TextExtractor.extract(file_path, file_name, page_range):
+        add_chunks(chunker.iter_chunks(
+            text=page["text"],
+            doc_id=doc_id,
+            file_name=file_name,
+            page_number=page["page_number"],
+            base_char_offset=page["char_start"],
+        ))
+        text_len = page["char_start"] + len(page["text"])
+    return chunks, text_len
+
+
+def _merge_page_ranges(doc_id: str, parts: List[Tuple[List[Dict], int]]) -> List[Dict]:
+    # Each range was chunked as if it started the document: shift its
+    # offsets past the earlier ranges and renumber ids across the whole file
+    merged = []
+    char_offset = 0
+    for chunks, text_len in parts:
+        for chunk in chunks:
+            chunk["char_start"] += char_offset
+            chunk["char_end"] += char_offset
+            chunk["chunk_id"] = f"{doc_id}-{len(merged)}"
+            merged.append(chunk)
+        char_offset += text_len
+    return merged
 
 
 class FileStorage:
     
     def __init__(self):
         self.courses: Dict[str, Dict] = {}
+        # Bumped on every change to the course set so readers can cache views of it
+        self.version = 0
         self.chunker = TextChunker()
+        self._extract_pool: Optional[ProcessPoolExecutor] = None
         os.makedirs(PERSIST_UPLOADS, exist_ok=True)
         os.makedirs(PERSIST_COURSES, exist_ok=True)
 
+    def _get_extract_pool(self) -> ProcessPoolExecutor:
+        if self._extract_pool is None:
+            # Spawned workers start clean instead of forking a process that
+            # already runs the event loop and worker threads
+            self._extract_pool = ProcessPoolExecutor(
+                max_workers=EXTRACT_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._extract_pool
+
+    def _drop_extract_pool(self, pool: ProcessPoolExecutor):
+        # Another upload may already have replaced the broken pool
+        if self._extract_pool is pool:
+            self._extract_pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    async def _run_extractions(
+        self,
+        extractions: List[Tuple[str, str, str, List[Optional[Tuple[int, int]]]]]
+    ) -> List[List[Tuple[List[Dict], int]]]:
+        loop = asyncio.get_running_loop()
+        # A worker that dies mid-parse (out of memory, a crashing parser)
+        # breaks the whole pool; it is replaced and the upload retried once
+        for attempt in range(2):
+            pool = self._get_extract_pool()
+            try:
+                # gather keeps upload order, so chunk order matches the serial path
+                return await asyncio.gather(*(
+                    asyncio.gather(*[
+                        loop.run_in_executor(
+                            pool,
+                            _extract_and_chunk,
+                            temp_path,
+                            file_name,
+                            doc_id,
+                            self.chunker.chunk_size,
+                            self.chunker.overlap,
+                            page_range,
+                        )
+                        for page_range in page_ranges
+                    ])
+                    for doc_id, temp_path, file_name, page_ranges in extractions
+                ))
+            except BrokenProcessPool:
+                self._drop_extract_pool(pool)
+                if attempt:
+                    raise
+
+    def close(self):
+        if self._extract_pool is not None:
+            self._extract_pool.shutdown(cancel_futures=True)
+            self._extract_pool = None
+
     def _course_dir(self, course_id: str) -> str:
         return os.path.join(PERSIST_UPLOADS, course_id)
 
     def _manifest_path(self, course_id: str) -> str:
         return os.path.join(PERSIST_COURSES, f"{course_id}.json")
 
+    def _chunks_path(self, course_id: str) -> str:
+        return os.path.join(PERSIST_COURSES, f"{course_id}{CHUNKS_SUFFIX}")
+
     def _save_manifest(self, course_id: str, processed_files: List[str], all_chunks: List[Dict]):
         manifest = {
             "course_id": course_id,
             "files": processed_files,
             "chunks": all_chunks,
         }
-        with open(self._manifest_path(course_id), "w", encoding="utf-8") as f:
-            json.dump(manifest, f)
+        self._write_manifest(course_id, manifest)
+
+    def _write_manifest(self, course_id: str, manifest: Dict):
+        # The chunks go to their own file so startup only has to read the
+        # small summary; it is written first so a summary never points at
+        # chunks that aren't on disk yet
+        chunks = manifest.get("chunks", [])
+        with open(self._chunks_path(course_id), "wb") as f:
+            f.write(orjson.dumps(_encode_chunks(chunks)))
+        summary = {key: value for key, value in manifest.items() if key != "chunks"}
+        summary["chunk_count"] = len(chunks)
+        with open(self._manifest_path(course_id), "wb") as f:
+            f.write(orjson.dumps(summary))
+
+    def _load_chunks(self, course_id: str) -> Dict:
+        # Persisted courses load their chunks on first use. Blocking, so
+        # async callers go through asyncio.to_thread. An unreadable chunks
+        # file raises OSError and is not cached, so a later read can retry
+        # and nothing rewrites the course from an empty list
+        info = self.courses.get(course_id)
+        if info is None:
+            return {}
+        if "chunks" not in info:
+            try:
+                with open(self._chunks_path(course_id), "rb") as f:
+                    chunks = _decode_manifest_chunks(orjson.loads(f.read()))
+            except Exception as e:
+                raise OSError(f"Chunks for course {course_id} are unreadable: {e}") from e
+            info["file_index"] = _build_file_index(chunks)
+            info["chunks"] = chunks
+        return info
     
     async def save_and_process_files(
         self, 
-        files: List[Tuple[str, bytes, str]]
+        files: List[Tuple[str, BinaryIO, str]]
     ) -> Tuple[str, List[str], List[Dict]]:
         course_id = str(uuid.uuid4())
         processed_files = []
         all_chunks = []
         saved_files: List[Dict] = []
+        extractions = []
         os.makedirs(self._course_dir(course_id), exist_ok=True)
         
-        for file_name, file_content, content_type in files:
-            if len(file_content) > MAX_FILE_SIZE:
+        for file_name, file_obj, content_type in files:
+            # Size the upload from its spooled file rather than reading it
+            file_obj.seek(0, os.SEEK_END)
+            size = file_obj.tell()
+            file_obj.seek(0)
+            if size > MAX_FILE_SIZE:
                 continue
             
             doc_id = str(uuid.uuid4())
             
             saved_name = f"{doc_id}_{file_name}"
             temp_path = os.path.join(self._course_dir(course_id), saved_name)
-            with open(temp_path, "wb") as f:
-                f.write(file_content)
+            await asyncio.to_thread(_copy_upload, file_obj, temp_path)
             
-            try:
-                pages = TextExtractor.extract(temp_path, file_name)
-                
-                for page in pages:
-                    chunks = self.chunker.chunk_text(
-                        text=page["text"],
-                        doc_id=doc_id,
-                        file_name=file_name,
-                        page_number=page["page_number"],
-                        base_char_offset=page["char_start"],
-                    )
-                    all_chunks.extend(chunks)
-                
-                processed_files.append(file_name)
-                saved_files.append({"file_name": file_name, "saved_name": saved_name})
-            finally:
-                # Keep the uploaded files persisted for future reuse
-                pass
+            if os.path.splitext(file_name)[1].lower() == ".pdf":
+                page_ranges = await asyncio.to_thread(_pdf_page_ranges, temp_path)
+            else:
+                page_ranges = [None]
+            
+            # Keep the uploaded files persisted for future reuse
+            extractions.append((doc_id, temp_path, file_name, page_ranges))
+            processed_files.append(file_name)
+            saved_files.append({"file_name": file_name, "saved_name": saved_name})
+        
+        try:
+            results = await self._run_extractions(extractions)
+        except BrokenProcessPool:
+            # Nothing references the course yet, so its saved files go too
+            await asyncio.to_thread(shutil.rmtree, self._course_dir(course_id), True)
+            raise
+        for (doc_id, *_), parts in zip(extractions, results):
+            if len(parts) == 1:
+                all_chunks.extend(parts[0][0])
+            else:
+                all_chunks.extend(_merge_page_ranges(doc_id, parts))
         
         self.courses[course_id] = {
             "course_id": course_id,
             "files": processed_files,
             "chunks": all_chunks,
             "saved_files": saved_files,
+            "file_index": _build_file_index(all_chunks),
+            "chunk_count": len(all_chunks),
         }
+        self.version += 1
         # include saved files in manifest
         manifest = {
             "course_id": course_id,
@@ -266,15 +550,15 @@ class FileStorage:
             "chunks": all_chunks,
             "saved_files": saved_files,
         }
-        with open(self._manifest_path(course_id), "w", encoding="utf-8") as f:
-            json.dump(manifest, f)
+        await asyncio.to_thread(self._write_manifest, course_id, manifest)
         
         return course_id, processed_files, all_chunks
     
     def get_course_chunks(self, course_id: str) -> List[Dict]:
-        if course_id in self.courses:
-            return self.courses[course_id].get("chunks", [])
-        return []
+        try:
+            return self._load_chunks(course_id).get("chunks", [])
+        except OSError:
+            return []
     
     def get_course_info(self, course_id: str) -> Optional[Dict]:
         return self.courses.get(course_id)
@@ -282,26 +566,47 @@ class FileStorage:
     def load_existing_courses(self):
         if not os.path.isdir(PERSIST_COURSES):
             return
-        for name in os.listdir(PERSIST_COURSES):
-            if not name.endswith(".json"):
-                continue
-            path = os.path.join(PERSIST_COURSES, name)
+        with os.scandir(PERSIST_COURSES) as entries:
+            manifests = [
+                entry for entry in entries
+                if entry.name.endswith(".json")
+                and not entry.name.endswith(CHUNKS_SUFFIX)
+                and entry.is_file()
+            ]
+        for entry in manifests:
+            name = entry.name
+            path = entry.path
             try:
-                with open(path, "r", encoding="utf-8") as f:
-                    manifest = json.load(f)
+                with open(path, "rb") as f:
+                    manifest = orjson.loads(f.read())
                 course_id = manifest.get("course_id") or os.path.splitext(name)[0]
                 files = manifest.get("files", [])
-                chunks = manifest.get("chunks", [])
                 saved_files = manifest.get("saved_files", [])
-                self.courses[course_id] = {
+                info = {
                     "course_id": course_id,
                     "files": files,
-                    "chunks": chunks,
                     "saved_files": saved_files,
+                    "chunk_count": manifest.get("chunk_count", 0),
                 }
+                if "chunks" in manifest:
+                    # Manifests from before the split carry their chunks inline
+                    chunks = _decode_manifest_chunks(manifest)
+                    info["chunks"] = chunks
+                    info["file_index"] = _build_file_index(chunks)
+                    info["chunk_count"] = len(chunks)
+                self.courses[course_id] = info
+                self.version += 1
             except Exception:
                 continue
 
+    def get_file_chunks(self, course_id: str, file_name: Optional[str]) -> List[Dict]:
+        try:
+            info = self._load_chunks(course_id)
+        except OSError:
+            return []
+        chunks = info.get("chunks", [])
+        return [chunks[i] for i in info.get("file_index", {}).get(file_name, [])]
+
     def get_saved_files(self, course_id: str) -> List[Dict]:
         info = self.courses.get(course_id)
         if not info:
@@ -318,9 +623,11 @@ class FileStorage:
                 break
         base_dir = self._course_dir(course_id)
         path = os.path.join(base_dir, saved_name)
-        size = os.path.getsize(path) if os.path.exists(path) else 0
-        chunks = info.get("chunks", [])
-        file_chunks = [ch for ch in chunks if ch.get("file_name") == original_name]
+        try:
+            size = os.stat(path).st_size
+        except OSError:
+            size = 0
+        file_chunks = self.get_file_chunks(course_id, original_name)
         page_count = 0
         if file_chunks:
             try:
@@ -336,7 +643,9 @@ class FileStorage:
         }
 
     def delete_file(self, course_id: str, saved_name: str) -> bool:
-        info = self.courses.get(course_id)
+        # Raises OSError, before touching anything, if the course's chunks
+        # can't be read
+        info = self._load_chunks(course_id)
         if not info:
             return False
         saved_files = info.get("saved_files", [])
@@ -355,14 +664,23 @@ class FileStorage:
             except Exception:
                 pass
         chunks = info.get("chunks", [])
-        remaining_chunks = [ch for ch in chunks if ch.get("file_name") != original_name]
+        file_index = info.get("file_index", {})
+        dropped = set(file_index.get(original_name, []))
+        if dropped:
+            remaining_chunks = [ch for i, ch in enumerate(chunks) if i not in dropped]
+            file_index = _build_file_index(remaining_chunks)
+        else:
+            remaining_chunks = chunks
         files_list = [fn for fn in info.get("files", []) if fn != original_name]
         self.courses[course_id] = {
             "course_id": course_id,
             "files": files_list,
             "chunks": remaining_chunks,
             "saved_files": new_saved,
+            "file_index": file_index,
+            "chunk_count": len(remaining_chunks),
         }
+        self.version += 1
         manifest = {
             "course_id": course_id,
             "files": files_list,
@@ -370,8 +688,7 @@ class FileStorage:
             "saved_files": new_saved,
         }
         try:
-            with open(self._manifest_path(course_id), "w", encoding="utf-8") as f:
-                json.dump(manifest, f)
+            self._write_manifest(course_id, manifest)
         except Exception:
             pass
         return True
@@ -393,14 +710,15 @@ class FileStorage:
                         pass
             except Exception:
                 pass
-            manifest_path = self._manifest_path(course_id)
-            try:
-                if os.path.exists(manifest_path):
-                    os.remove(manifest_path)
-            except Exception:
-                pass
+            for manifest_path in (self._manifest_path(course_id), self._chunks_path(course_id)):
+                try:
+                    if os.path.exists(manifest_path):
+                        os.remove(manifest_path)
+                except Exception:
+                    pass
             count += 1
         self.courses = {}
+        self.version += 1
         return count
 
 
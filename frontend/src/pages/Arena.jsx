@@ -27,6 +27,7 @@ function Arena() {
   
   const wsRef = useRef(null)
   const cooldownTimerRef = useRef(null)
+  const roundDeadlineRef = useRef(0)
 
   const connectWebSocket = useCallback(() => {
     const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:'
@@ -80,6 +81,17 @@ function Arena() {
     }
   }, [connectWebSocket])
 
+  // The server only announces the round length; the countdown runs locally
+  useEffect(() => {
+    if (!currentQuestion) return
+    const tick = () => {
+      setTimeLeft(Math.max(0, Math.ceil((roundDeadlineRef.current - Date.now()) / 1000)))
+    }
+    tick()
+    const timer = setInterval(tick, 250)
+    return () => clearInterval(timer)
+  }, [currentQuestion])
+
   useEffect(() => {
     if (cooldown > 0) {
       cooldownTimerRef.current = setInterval(() => {
@@ -112,8 +124,9 @@ function Arena() {
         break
 
       case 'round_start':
+        roundDeadlineRef.current = Date.now() + (data.seconds_left ?? data.time_limit) * 1000
         setCurrentQuestion(data)
-        setTimeLeft(data.time_limit)
+        setTimeLeft(data.seconds_left ?? data.time_limit)
         setAnswer('')
         setSelectedOption(null)
         setRoundResult(null)
@@ -129,10 +142,6 @@ function Arena() {
         }])
         break
 
-      case 'round_update':
-        setTimeLeft(data.seconds_left)
-        break
-
       case 'skip_update':
         const skipped = {}
         ;(data.skipped_by || []).forEach(name => { skipped[name] = true })